@@ -1,10 +1,8 @@
 import streamlit as st
 import os
-import time
 import json
 import sys
 from pathlib import Path
-import sqlite3
 
 # Get the absolute path to the project root
 project_root = Path(__file__).parent.absolute()
@@ -124,24 +122,19 @@ with chat_container:
         # Initialize a variable to collect the full response
         full_response = ""
         
-        # Get response and context
+        # Retrieval runs under the spinner; the answer then streams in as the model writes it
         with st.spinner("Thinking..."):
-            # Modify LLM to capture context or simulate it here
-            response, context = st.session_state.llm.answer_question_with_context(last_user_message)
-            
-            # Store context for display
-            st.session_state.last_context = context
-            
-            # Simulate streaming
-            chunks = [response[i:i+10] for i in range(0, len(response), 10)]
-            
-            for chunk in chunks:
-                full_response += chunk
-                message_placeholder.markdown(f"<div class='assistant-message'>{full_response}</div>", unsafe_allow_html=True)
-                time.sleep(0.03)  # Slightly faster streaming
+            context, chunks = st.session_state.llm.stream_answer_with_context(last_user_message)
+        
+        # Store context for display
+        st.session_state.last_context = context
+        
+        for chunk in chunks:
+            full_response += chunk
+            message_placeholder.markdown(f"<div class='assistant-message'>{full_response}</div>", unsafe_allow_html=True)
         
         # Add assistant response to history after streaming is complete
-        st.session_state.messages.append({"role": "assistant", "content": response})
+        st.session_state.messages.append({"role": "assistant", "content": full_response})
         
         # Reset processing flag
         st.session_state.processing = False
@@ -213,16 +206,3 @@ def inject_scroll_js():
 
 # Add this call at the end of your app
 inject_scroll_js()
-
-def execute_sql_query(self, query):
-    """Execute SQL query with a fresh connection and return cheese IDs"""
-    try:
-        # Create a new connection for each query
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(query)
-            results = cursor.fetchall()
-            return [row[0] for row in results]
-    except sqlite3.Error as e:
-        print(f"SQLite error: {e}")
-        return []
\ No newline at end of file
@@ -1,11 +1,64 @@
-from .pinecone_client import create_pinecone_index, upsert_to_pinecone, search_cheeses
+from .pinecone_client import create_pinecone_index, upsert_to_pinecone, search_cheeses, search_cheeses_many
 from .embeddings import create_embeddings
 from .data_processor import process_cheese_data
+from .registry import (
+    get_config,
+    get_http_client,
+    get_openai_client,
+    get_async_http_client,
+    get_async_openai_client,
+    get_pinecone_client,
+    get_pinecone_index,
+    get_event_loop,
+    run_sync,
+    iterate_sync,
+    get_shared_vector_store,
+    get_vector_snapshot
+)
+from .ann_index import IVFPQIndex
+from .lexical_index import BM25Index, build_lexical_index
+from .filters import ColumnarMetadata, FilterError, compile_filter
+from .tracing import Tracer, get_tracer
+from .vector_store import (
+    VectorStore,
+    PineconeVectorStore,
+    LocalVectorStore,
+    QuantizedVectorStore,
+    build_quantized_store,
+    get_vector_store
+)
 
 __all__ = [
     'create_pinecone_index', 
     'upsert_to_pinecone', 
     'search_cheeses',
+    'search_cheeses_many',
     'create_embeddings',
-    'process_cheese_data'
+    'process_cheese_data',
+    'VectorStore',
+    'PineconeVectorStore',
+    'LocalVectorStore',
+    'QuantizedVectorStore',
+    'build_quantized_store',
+    'IVFPQIndex',
+    'BM25Index',
+    'build_lexical_index',
+    'ColumnarMetadata',
+    'FilterError',
+    'compile_filter',
+    'Tracer',
+    'get_tracer',
+    'get_config',
+    'get_http_client',
+    'get_openai_client',
+    'get_async_http_client',
+    'get_async_openai_client',
+    'get_pinecone_client',
+    'get_pinecone_index',
+    'get_event_loop',
+    'run_sync',
+    'iterate_sync',
+    'get_shared_vector_store',
+    'get_vector_snapshot',
+    'get_vector_store'
 ]
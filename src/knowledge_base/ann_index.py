@@ -0,0 +1,375 @@
+import json
+import os
+import threading
+import numpy as np
+from .vector_store import LocalVectorStore, Match, QueryResult, VectorStore
+
+
+def _assign(x, centroids, batch_size=65536):
+    """Index of the nearest centroid (squared L2) for every row of x, computed in batches"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), batch_size):
+        batch = x[start:start + batch_size]
+        distances = centroid_norms - 2.0 * (batch @ centroids.T)
+        labels[start:start + batch_size] = distances.argmin(axis=1)
+    return labels
+
+
+def _kmeans(x, k, iterations=20, seed=0):
+    """Plain Lloyd k-means, reseeding empty clusters from random points"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), size=int(empty.sum()), replace=False)]
+
+    return centroids
+
+
+class IVFPQIndex(VectorStore):
+    """Inverted-file index with product-quantized residuals for approximate inner-product search
+
+    Vectors are normalized, so inner product equals cosine similarity. nprobe trades recall
+    for latency at query time; refine_factor re-ranks top_k * refine_factor candidates with
+    the exact stored vectors (0 disables it and skips storing raw vectors).
+
+    Upserting an existing id tombstones its old position and appends the new vector;
+    tombstoned entries are skipped by queries and dropped when the index is flushed.
+
+    Loading, encoding and flushing hold a lock; queries take a consistent view of the
+    index under it and score outside it, so concurrent queries don't serialize.
+    """
+    def __init__(self, path, dimension=1536, nlist=0, m=16, nprobe=8, refine_factor=10,
+                 train_size=0, seed=0):
+        self.path = path
+        self.dimension = dimension
+        self.nlist = nlist
+        self.m = m
+        self.nprobe = nprobe
+        self.refine_factor = refine_factor
+        self.train_size = train_size
+        self.seed = seed
+
+        self._loaded = False
+        self.centroids = None
+        self.codebooks = None
+        self.ids = []
+        self.metadata = []
+        self.list_codes = []
+        self.list_positions = []
+        self.vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._pending = []
+        self._positions = {}
+        # Positions replaced by a later upsert of the same id, and the matching live-row mask
+        self._deleted = set()
+        self._live = None
+        # Whether anything changed since the index was loaded or last flushed
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _meta_path(self):
+        return os.path.join(self.path, "ivfpq.json")
+
+    def _ensure_loaded(self):
+        """Load the persisted index on first use"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if os.path.exists(self._meta_path()):
+                self.load()
+            # Set only once loading succeeded, so other threads never see a half-loaded index
+            self._loaded = True
+
+    def load(self):
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        with open(self._meta_path(), 'r') as f:
+            info = json.load(f)
+        self.dimension = info["dimension"]
+        self.nlist = info["nlist"]
+        self.m = info["m"]
+        self.ids = info["ids"]
+        self.metadata = info["metadata"]
+        self._positions = {vector_id: i for i, vector_id in enumerate(self.ids)}
+        self._deleted = set()
+        self._live = None
+        self._columns = None
+
+        self.centroids = np.load(os.path.join(self.path, "centroids.npy"))
+        self.codebooks = np.load(os.path.join(self.path, "codebooks.npy"))
+        codes = np.load(os.path.join(self.path, "codes.npy"), mmap_mode='r')
+        positions = np.load(os.path.join(self.path, "positions.npy"))
+        offsets = np.load(os.path.join(self.path, "offsets.npy"))
+        self.list_codes = [np.asarray(codes[offsets[i]:offsets[i + 1]]) for i in range(self.nlist)]
+        self.list_positions = [positions[offsets[i]:offsets[i + 1]] for i in range(self.nlist)]
+
+        vectors_path = os.path.join(self.path, "vectors.npy")
+        if os.path.exists(vectors_path):
+            self.vectors = np.load(vectors_path, mmap_mode='r')
+        self._dirty = False
+
+    def _save(self, name, array):
+        """Write one array next to its final path and swap it in.
+
+        Arrays loaded from the index are memory-mapped views of these files, so writing
+        them in place would truncate the mapping that is being read from.
+        """
+        path = os.path.join(self.path, name)
+        with open(path + ".tmp", 'wb') as f:
+            np.save(f, array)
+        os.replace(path + ".tmp", path)
+
+    def flush(self):
+        """Train if needed and persist centroids, codebooks, inverted lists and metadata"""
+        self._ensure_loaded()
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._encode_pending(force=True)
+        if not self.is_trained or not self._dirty:
+            return
+        self._compact()
+
+        os.makedirs(self.path, exist_ok=True)
+        offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(codes) for codes in self.list_codes])
+        self._save("centroids.npy", self.centroids)
+        self._save("codebooks.npy", self.codebooks)
+        self._save("codes.npy", np.concatenate(self.list_codes))
+        self._save("positions.npy", np.concatenate(self.list_positions))
+        self._save("offsets.npy", offsets)
+        if self.refine_factor:
+            self._save("vectors.npy", np.asarray(self.vectors, dtype=np.float32))
+
+        # The metadata file is written last, so a load never sees ids without their codes
+        with open(self._meta_path() + ".tmp", 'w') as f:
+            json.dump({
+                "dimension": self.dimension,
+                "nlist": self.nlist,
+                "m": self.m,
+                "ids": self.ids,
+                "metadata": self.metadata
+            }, f)
+        os.replace(self._meta_path() + ".tmp", self._meta_path())
+        self._dirty = False
+
+    def _compact(self):
+        """Drop tombstoned entries and renumber positions (new objects, so query views stay valid)"""
+        if not self._deleted:
+            return
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[list(self._deleted)] = False
+        renumber = np.cumsum(keep) - 1
+
+        self.ids = [vector_id for vector_id, kept in zip(self.ids, keep) if kept]
+        self.metadata = [item for item, kept in zip(self.metadata, keep) if kept]
+        if len(self.vectors):
+            self.vectors = np.asarray(self.vectors)[keep]
+        list_codes, list_positions = [], []
+        for codes, positions in zip(self.list_codes, self.list_positions):
+            kept = keep[positions]
+            list_codes.append(codes[kept])
+            list_positions.append(renumber[positions[kept]])
+        self.list_codes, self.list_positions = list_codes, list_positions
+        self._positions = {vector_id: i for i, vector_id in enumerate(self.ids)}
+        self._deleted = set()
+        self._live = None
+        self._columns = None
+
+    def __len__(self):
+        self._ensure_loaded()
+        with self._lock:
+            pending = sum(len(batch) for _, batch, _ in self._pending)
+            return len(self.ids) - len(self._deleted) + pending
+
+    def train(self, vectors):
+        """Learn the coarse centroids and the residual PQ codebooks"""
+        vectors = LocalVectorStore._normalize(vectors)
+        if self.dimension % self.m:
+            raise ValueError(f"dimension {self.dimension} is not divisible by m={self.m}")
+
+        if not self.nlist:
+            self.nlist = max(1, int(np.sqrt(len(vectors))))
+        self.nlist = min(self.nlist, len(vectors))
+
+        rng = np.random.default_rng(self.seed)
+        train_size = self.train_size or min(len(vectors), max(self.nlist * 64, 256 * 64))
+        sample = vectors[rng.choice(len(vectors), size=min(train_size, len(vectors)), replace=False)]
+
+        self.centroids = _kmeans(sample, self.nlist, seed=self.seed)
+        residuals = sample - self.centroids[_assign(sample, self.centroids)]
+
+        dsub = self.dimension // self.m
+        ksub = min(256, len(sample))
+        self.codebooks = np.stack([
+            _kmeans(np.ascontiguousarray(residuals[:, j * dsub:(j + 1) * dsub]), ksub, seed=self.seed + j)
+            for j in range(self.m)
+        ]).astype(np.float32)
+
+        self.list_codes = [np.zeros((0, self.m), dtype=np.uint8) for _ in range(self.nlist)]
+        self.list_positions = [np.zeros(0, dtype=np.int64) for _ in range(self.nlist)]
+        self._dirty = True
+
+    def _encode(self, vectors):
+        labels = _assign(vectors, self.centroids)
+        residuals = vectors - self.centroids[labels]
+        dsub = self.dimension // self.m
+        codes = np.stack([
+            _assign(np.ascontiguousarray(residuals[:, j * dsub:(j + 1) * dsub]), self.codebooks[j])
+            for j in range(self.m)
+        ], axis=1).astype(np.uint8)
+        return labels, codes
+
+    def _encode_pending(self, force=False):
+        """Encode buffered inserts, training first from the buffer when the index is empty
+        (called with the lock held)"""
+        if not self._pending:
+            return
+        buffered = sum(len(batch) for _, batch, _ in self._pending)
+        if not self.is_trained:
+            if not force and buffered < (self.train_size or 256 * 64):
+                return
+
+        ids = [vector_id for batch_ids, _, _ in self._pending for vector_id in batch_ids]
+        metadata = [item for _, _, batch_metadata in self._pending for item in batch_metadata]
+        vectors = np.vstack([batch for _, batch, _ in self._pending])
+        self._pending = []
+
+        if not self.is_trained:
+            self.train(vectors)
+
+        start = len(self.ids)
+        self._dirty = True
+        self.ids.extend(ids)
+        self.metadata.extend(metadata)
+        for offset, vector_id in enumerate(ids):
+            # An upsert of a known id (or one repeated in the buffer) replaces the older entry
+            previous = self._positions.get(vector_id)
+            if previous is not None:
+                self._deleted.add(previous)
+                self._live = None
+            self._positions[vector_id] = start + offset
+        if self.refine_factor:
+            self.vectors = np.vstack([np.asarray(self.vectors), vectors])
+
+        labels, codes = self._encode(vectors)
+        positions = np.arange(start, start + len(ids), dtype=np.int64)
+        order = np.argsort(labels, kind='stable')
+        bounds = np.searchsorted(labels[order], np.arange(self.nlist + 1))
+        for list_id in range(self.nlist):
+            chunk = order[bounds[list_id]:bounds[list_id + 1]]
+            if len(chunk):
+                self.list_codes[list_id] = np.concatenate([self.list_codes[list_id], codes[chunk]])
+                self.list_positions[list_id] = np.concatenate([self.list_positions[list_id], positions[chunk]])
+
+    def add(self, ids, vectors, metadata=None):
+        """Insert or replace vectors; they are encoded in bulk once the index is trained"""
+        self._ensure_loaded()
+        vectors = LocalVectorStore._normalize(vectors)
+        metadata = metadata if metadata is not None else [{} for _ in ids]
+
+        with self._lock:
+            # Re-upserting an unchanged entry (same stored vector and metadata) is a no-op
+            changed = [i for i, vector_id in enumerate(ids) if not self._unchanged(vector_id, vectors[i], metadata[i])]
+            if not changed:
+                return
+            self._pending.append((
+                [ids[i] for i in changed],
+                vectors[changed],
+                [metadata[i] for i in changed]
+            ))
+            self._encode_pending()
+
+    def _unchanged(self, vector_id, vector, metadata):
+        position = self._positions.get(vector_id)
+        if position is None or position >= len(self.vectors) or self.metadata[position] != metadata:
+            return False
+        return np.array_equal(self.vectors[position], vector)
+
+    def upsert(self, vectors):
+        self.add(
+            [vector["id"] for vector in vectors],
+            [vector["values"] for vector in vectors],
+            [vector.get("metadata", {}) for vector in vectors]
+        )
+
+    def query(self, vector, top_k, filter=None, include_metadata=True, nprobe=None):
+        """Approximate top_k search over the nprobe closest inverted lists"""
+        self._ensure_loaded()
+        with self._lock:
+            self._encode_pending(force=True)
+            if not self.ids:
+                return QueryResult([])
+            # Writers replace these objects (or only append to ids and metadata), so this
+            # view stays consistent after the lock is released
+            centroids, codebooks = self.centroids, self.codebooks
+            list_codes, list_positions = list(self.list_codes), list(self.list_positions)
+            ids, metadata, stored_vectors = self.ids, self.metadata, self.vectors
+            allowed = self.filter_mask(filter) if filter else None
+            if self._deleted:
+                if self._live is None or len(self._live) != len(self.ids):
+                    self._live = np.ones(len(self.ids), dtype=bool)
+                    self._live[list(self._deleted)] = False
+                allowed = self._live if allowed is None else allowed & self._live
+
+        vector = LocalVectorStore._normalize(vector)
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+
+        coarse = centroids @ vector
+        probe = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        # Asymmetric distance table: inner product of each query sub-vector with each codeword
+        dsub = self.dimension // self.m
+        table = np.einsum('mkd,md->mk', codebooks, vector.reshape(self.m, dsub))
+        subspaces = np.arange(self.m)
+
+        positions = np.concatenate([list_positions[list_id] for list_id in probe])
+        scores = np.concatenate([
+            coarse[list_id] + table[subspaces, list_codes[list_id]].sum(axis=1)
+            for list_id in probe
+        ]).astype(np.float32)
+
+        if allowed is not None:
+            mask = allowed[positions]
+            positions = positions[mask]
+            scores = scores[mask]
+
+        k = min(top_k, len(positions))
+        if k <= 0:
+            return QueryResult([])
+
+        if self.refine_factor and len(stored_vectors):
+            shortlist = min(k * self.refine_factor, len(positions))
+            best = np.argpartition(-scores, shortlist - 1)[:shortlist]
+            positions = np.sort(positions[best])
+            scores = np.asarray(stored_vectors[positions], dtype=np.float32) @ vector
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return QueryResult([
+            Match(
+                id=ids[positions[i]],
+                score=float(scores[i]),
+                metadata=metadata[positions[i]] if include_metadata else None
+            )
+            for i in top
+        ])
@@ -177,7 +177,7 @@ def suggest_use_cases(title, categories):
             use_cases.extend(["cheese boards", "appetizers", "wine pairing"])
     
     # Remove duplicates and limit to a reasonable number
-    unique_use_cases = list(set(use_cases))
+    unique_use_cases = list(dict.fromkeys(use_cases))
     if not unique_use_cases:
         return "cheese boards, cooking, sandwiches, and various recipes"
     
@@ -1,26 +1,78 @@
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
-import yaml
+from concurrent.futures import ThreadPoolExecutor
+import tiktoken
+from .registry import get_config, get_openai_client
+
+# OpenAI embedding request limits
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300000
+
+_encodings = {}
 
 def load_config():
-    with open('config/config.yaml', 'r') as file:
-        return yaml.safe_load(file)
+    return get_config()
+
+def _get_encoding(model):
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # The BPE files are downloaded on first use; without network fall back to an estimate
+            print(f"tiktoken encoding unavailable ({e.__class__.__name__}), estimating token counts")
+            _encodings[model] = None
+    return _encodings[model]
+
+def count_tokens(text, model):
+    """Number of tokens in text for the given model (about 4 characters per token if tiktoken is unavailable)"""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def pack_batches(texts, model, max_tokens=MAX_TOKENS_PER_REQUEST, max_inputs=MAX_INPUTS_PER_REQUEST):
+    """Group text indices into request-sized batches by token count, preserving order"""
+    batches = []
+    current, current_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text, model)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
 
 def create_embeddings(texts):
     """Create embeddings for a list of texts using OpenAI's API"""
-    # Load environment variables and configuration
-    load_dotenv()
-    config = load_config()
+    config = get_config()
+    model = config['vector_db']['embeddings']['model']
+    
+    # Shared OpenAI client
+    client = get_openai_client()
     
-    # Initialize OpenAI client
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def embed(batch):
+        response = client.embeddings.create(
+            input=[texts[i] for i in batch],
+            model=model
+        )
+        return [item.embedding for item in response.data]
     
-    # Get embeddings from OpenAI
-    response = client.embeddings.create(
-        input=texts,
-        model=config['vector_db']['embeddings']['model']
-    )
+    # Token-packed requests, sent concurrently when there is more than one
+    batches = pack_batches(texts, model)
+    if len(batches) == 1:
+        results = [embed(batches[0])]
+    else:
+        max_workers = config['vector_db']['embeddings'].get('max_concurrency', 4)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(embed, batches))
     
-    # Return the embeddings
-    return [item.embedding for item in response.data]
+    # Return the embeddings in input order
+    embeddings = [None] * len(texts)
+    for batch, batch_embeddings in zip(batches, results):
+        for i, embedding in zip(batch, batch_embeddings):
+            embeddings[i] = embedding
+    return embeddings
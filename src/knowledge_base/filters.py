@@ -0,0 +1,172 @@
+import json
+import threading
+from collections import OrderedDict, defaultdict
+import numpy as np
+
+# Operators documented for the Pinecone filters produced by the retriever prompt
+RANGE_OPERATORS = {
+    "$gt": np.greater,
+    "$gte": np.greater_equal,
+    "$lt": np.less,
+    "$lte": np.less_equal,
+}
+VALUE_OPERATORS = {"$eq", "$ne", "$in", "$nin"}
+
+
+class FilterError(ValueError):
+    """Raised for filters with unknown fields, unsupported operators or bad operands"""
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float, bool))
+
+
+class _Column:
+    """One metadata field: dictionary-encoded values plus a float view for range comparisons"""
+    def __init__(self, values):
+        self.dictionary = {}
+        self.codes = np.full(len(values), -1, dtype=np.int32)
+        self.numbers = np.full(len(values), np.nan)
+        members = defaultdict(list)
+
+        for position, value in enumerate(values):
+            if value is None:
+                continue
+            if isinstance(value, list):
+                # List fields match $eq/$in when any element matches, as in Pinecone
+                for item in value:
+                    if _is_scalar(item):
+                        members[item].append(position)
+                continue
+            if not _is_scalar(value):
+                continue
+            self.codes[position] = self.dictionary.setdefault(value, len(self.dictionary))
+            if _is_number(value):
+                self.numbers[position] = value
+
+        self.members = {value: np.asarray(rows, dtype=np.int64) for value, rows in members.items()}
+
+    def equals(self, operands):
+        codes = [self.dictionary[operand] for operand in operands if operand in self.dictionary]
+        mask = np.isin(self.codes, codes) if codes else np.zeros(len(self.codes), dtype=bool)
+        for operand in operands:
+            rows = self.members.get(operand)
+            if rows is not None:
+                mask[rows] = True
+        return mask
+
+    def compare(self, op, operand):
+        # Missing and non-numeric values are NaN, which never satisfies a comparison
+        with np.errstate(invalid='ignore'):
+            return RANGE_OPERATORS[op](self.numbers, operand)
+
+
+def _compile_condition(field, condition):
+    if not isinstance(condition, dict):
+        condition = {"$eq": condition}
+    if not condition:
+        raise FilterError(f"Empty condition for field '{field}'")
+
+    tests = []
+    for op, operand in condition.items():
+        if op in ("$eq", "$ne"):
+            if not _is_scalar(operand):
+                raise FilterError(f"{op} on '{field}' needs a string, number or boolean")
+            negate = op == "$ne"
+            tests.append(lambda columns, value=operand, negate=negate:
+                         ~columns[field].equals([value]) if negate else columns[field].equals([value]))
+        elif op in ("$in", "$nin"):
+            if not isinstance(operand, list) or not all(_is_scalar(item) for item in operand):
+                raise FilterError(f"{op} on '{field}' needs a list of strings, numbers or booleans")
+            negate = op == "$nin"
+            tests.append(lambda columns, values=operand, negate=negate:
+                         ~columns[field].equals(values) if negate else columns[field].equals(values))
+        elif op in RANGE_OPERATORS:
+            if not _is_number(operand):
+                raise FilterError(f"{op} on '{field}' needs a number")
+            tests.append(lambda columns, op=op, value=operand: columns[field].compare(op, value))
+        else:
+            raise FilterError(f"Unsupported filter operator: {op}")
+
+    if len(tests) == 1:
+        return tests[0]
+    return lambda columns: np.logical_and.reduce([test(columns) for test in tests])
+
+
+def compile_filter(filter, schema):
+    """Compile a Pinecone-style filter into a function from columns to a boolean mask.
+
+    Field names are checked against schema and operands against their operator, so a
+    bad filter fails here instead of silently matching nothing.
+    """
+    if not isinstance(filter, dict) or not filter:
+        raise FilterError("A filter must be a non-empty object")
+
+    parts = []
+    for key, condition in filter.items():
+        if key in ("$and", "$or"):
+            if not isinstance(condition, list) or not condition:
+                raise FilterError(f"{key} needs a non-empty list of filters")
+            subfilters = [compile_filter(sub, schema) for sub in condition]
+            reduce = np.logical_and.reduce if key == "$and" else np.logical_or.reduce
+            parts.append(lambda columns, subfilters=subfilters, reduce=reduce:
+                         reduce([sub(columns) for sub in subfilters]))
+        elif key.startswith("$"):
+            raise FilterError(f"Unsupported filter operator: {key}")
+        elif key not in schema:
+            raise FilterError(f"Unknown metadata field: {key}")
+        else:
+            parts.append(_compile_condition(key, condition))
+
+    if len(parts) == 1:
+        return parts[0]
+    return lambda columns: np.logical_and.reduce([part(columns) for part in parts])
+
+
+class ColumnarMetadata:
+    """Column-wise copy of a metadata list that evaluates filters as NumPy masks.
+
+    Masks for recently used filters are cached, so repeated filters cost a dict lookup.
+    """
+    def __init__(self, metadata_list, schema=None, cache_size=256):
+        self.size = len(metadata_list)
+        fields = dict.fromkeys(schema or ())
+        for metadata in metadata_list:
+            fields.update(dict.fromkeys(metadata))
+        self.columns = {
+            field: _Column([metadata.get(field) for metadata in metadata_list])
+            for field in fields
+        }
+        self.cache_size = cache_size
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def schema(self):
+        return set(self.columns)
+
+    def mask(self, filter):
+        """Read-only boolean mask of the rows matching filter"""
+        key = json.dumps(filter, sort_keys=True)
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+
+        mask = np.asarray(compile_filter(filter, self.columns)(self.columns), dtype=bool)
+        mask.flags.writeable = False
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self.cache_size:
+                self._masks.popitem(last=False)
+        return mask
+
+
+def filter_mask(metadata_list, filter):
+    """Boolean mask of the metadata rows matching a filter expression"""
+    return ColumnarMetadata(metadata_list).mask(filter)
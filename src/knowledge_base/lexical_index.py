@@ -0,0 +1,134 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+# Keeps sizes such as "4/5" and decimals such as "2.5" together as single tokens
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[/.][a-z0-9]+)*")
+
+# Fields indexed for lexical search and how many times their tokens are counted
+FIELD_WEIGHTS = {
+    "title": 3,
+    "brand": 2,
+    "sku": 2,
+    "all_categories": 2,
+    "category": 2,
+    "image_description": 1,
+}
+
+
+def tokenize(text):
+    """Lowercase alphanumeric tokens"""
+    return _TOKEN_PATTERN.findall(str(text).lower()) if text else []
+
+
+def document_tokens(metadata):
+    """Weighted token list for one product (a simple BM25F approximation)"""
+    tokens = []
+    for field, weight in FIELD_WEIGHTS.items():
+        value = metadata.get(field)
+        if isinstance(value, list):
+            value = " ".join(str(item) for item in value)
+        tokens.extend(tokenize(value) * weight)
+    return tokens
+
+
+def fuse_rankings(rankings, k=60):
+    """Reciprocal rank fusion of several ranked id lists into {id: fused score}"""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return dict(fused)
+
+
+class BM25Index:
+    """Okapi BM25 over title, brand, categories and description of each product"""
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.metadata = []
+        self.doc_lengths = []
+        self.postings = {}
+        self.avg_length = 0.0
+
+    def build(self, ids, metadata_list):
+        """Index products given their vector ids and processed metadata"""
+        self.ids = list(ids)
+        self.metadata = list(metadata_list)
+        self.doc_lengths = []
+        postings = defaultdict(list)
+
+        for position, metadata in enumerate(self.metadata):
+            tokens = document_tokens(metadata)
+            self.doc_lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                postings[term].append([position, frequency])
+
+        self.postings = dict(postings)
+        self.avg_length = sum(self.doc_lengths) / max(len(self.doc_lengths), 1)
+        return self
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.ids) - df + 0.5) / (df + 0.5))
+
+    def search(self, query, top_k=20, allowed_upcs=None):
+        """Return (id, score, metadata) tuples for the best BM25 matches, optionally limited to some UPCs"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for position, frequency in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[position] / self.avg_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+
+        if allowed_upcs is not None:
+            allowed_upcs = set(allowed_upcs)
+            scores = {
+                position: score for position, score in scores.items()
+                if self.metadata[position].get("upc") in allowed_upcs
+            }
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(self.ids[position], score, self.metadata[position]) for position, score in best]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                "k1": self.k1,
+                "b": self.b,
+                "ids": self.ids,
+                "metadata": self.metadata,
+                "doc_lengths": self.doc_lengths,
+                "postings": self.postings
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as f:
+            stored = json.load(f)
+        index = cls(k1=stored["k1"], b=stored["b"])
+        index.ids = stored["ids"]
+        index.metadata = stored["metadata"]
+        index.doc_lengths = stored["doc_lengths"]
+        index.postings = stored["postings"]
+        index.avg_length = sum(index.doc_lengths) / max(len(index.doc_lengths), 1)
+        return index
+
+
+def build_lexical_index(processed_data, path, k1=1.5, b=0.75):
+    """Build and save the BM25 index at ingestion, using the same ids as the vector store"""
+    ids = [f"cheese_{i}" for i in range(len(processed_data))]
+    index = BM25Index(k1=k1, b=b).build(ids, [item['metadata'] for item in processed_data])
+    index.save(path)
+    print(f"Built lexical index with {len(index)} products and {len(index.postings)} terms at {path}")
+    return index
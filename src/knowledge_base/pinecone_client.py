@@ -1,24 +1,34 @@
-import os
-from pinecone import Pinecone, ServerlessSpec
-from dotenv import load_dotenv
-from openai import OpenAI
-import yaml
+from pinecone import ServerlessSpec
+from .embeddings import create_embeddings
+from .registry import get_config, get_openai_client, get_pinecone_client, get_pinecone_index, get_shared_vector_store
+from .vector_store import (
+    LocalVectorStore,
+    QuantizedVectorStore,
+    build_quantized_store,
+    evaluate_recall,
+    get_vector_store,
+    sample_queries
+)
+
+# Index names already verified to exist in this process
+_ensured_indexes = set()
 
 def load_config():
-    with open('config/config.yaml', 'r') as file:
-        return yaml.safe_load(file)
+    return get_config()
 
 def create_pinecone_index():
     """Create a new Pinecone index if it doesn't exist"""
-    # Load environment variables and configuration
-    load_dotenv()
-    config = load_config()
+    config = get_config()
+    index_name = config['vector_db']['pinecone']['index_name']
+    
+    # The existence check only needs to happen once per process
+    if index_name in _ensured_indexes:
+        return get_pinecone_index(index_name)
     
-    # Initialize Pinecone client
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    # Shared Pinecone client
+    pc = get_pinecone_client()
     
     # Get index settings from config
-    index_name = config['vector_db']['pinecone']['index_name']
     dimension = config['vector_db']['pinecone']['dimension']
     metric = config['vector_db']['pinecone']['metric']
     cloud = config['vector_db']['pinecone']['cloud']
@@ -35,25 +45,30 @@ def create_pinecone_index():
         print(f"Created new Pinecone index: {index_name}")
     else:
         print(f"Using existing Pinecone index: {index_name}")
+    _ensured_indexes.add(index_name)
     
     # Return the index
-    return pc.Index(index_name)
+    return get_pinecone_index(index_name)
 
 def upsert_to_pinecone(processed_data, batch_size=None):
-    """Upsert processed data to Pinecone in batches"""
-    # Load environment variables and configuration
-    load_dotenv()
-    config = load_config()
+    """Upsert processed data to the configured vector store in batches"""
+    config = get_config()
     
     # Get batch size from config or use provided value
     if batch_size is None:
         batch_size = config['vector_db']['embeddings']['batch_size']
     
-    # Initialize OpenAI client
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    # Shared OpenAI client
+    client = get_openai_client()
     
-    # Get or create Pinecone index
-    index = create_pinecone_index()
+    # Get or create the configured vector store
+    index = get_vector_store(config, create=True)
+    
+    # The local snapshot is always written so the local backend works offline
+    local_store = index if isinstance(index, LocalVectorStore) else LocalVectorStore(
+        config['vector_db']['local']['path'],
+        dimension=config['vector_db']['pinecone']['dimension']
+    )
     
     # Process in batches
     for i in range(0, len(processed_data), batch_size):
@@ -80,25 +95,40 @@ def upsert_to_pinecone(processed_data, batch_size=None):
                 "metadata": metadata_list[j]
             })
         
-        # Upsert to Pinecone
-        index.upsert(vectors=vectors)
+        # Upsert to the vector store
+        index.upsert(vectors)
+        if local_store is not index:
+            local_store.upsert(vectors)
         print(f"Processed and uploaded batch {i//batch_size + 1}/{(len(processed_data) + batch_size - 1)//batch_size}")
     
+    index.flush()
+    if local_store is not index:
+        local_store.flush()
+    
+    # Build the quantized memory-mapped store and report its recall against float32 search
+    quantization = config['vector_db']['local'].get('quantization', 'none')
+    if quantization != 'none':
+        build_quantized_store(local_store.path, dtype=quantization)
+        quantized_store = QuantizedVectorStore(
+            local_store.path,
+            rerank_factor=config['vector_db']['local'].get('rerank_factor', 4)
+        )
+        for k in (1, 5, 10):
+            recall = evaluate_recall(local_store, quantized_store, sample_queries(local_store), k=k)
+            print(f"Quantized store recall@{k}: {recall:.4f}")
+    
     print("Vector database updated successfully!")
     return index
 
 def search_cheeses(query, top_k=5):
     """Search for cheeses matching the query"""
-    # Load environment variables and configuration
-    load_dotenv()
-    config = load_config()
+    config = get_config()
     
-    # Initialize OpenAI client
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    # Shared OpenAI client
+    client = get_openai_client()
     
-    # Get Pinecone index
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-    index = pc.Index(config['vector_db']['pinecone']['index_name'])
+    # The configured vector store, loaded once per process
+    index = get_shared_vector_store()
     
     # Create query embedding
     query_response = client.embeddings.create(
@@ -107,7 +137,7 @@ def search_cheeses(query, top_k=5):
     )
     query_embedding = query_response.data[0].embedding
     
-    # Search Pinecone
+    # Search the vector store
     search_results = index.query(
         vector=query_embedding,
         top_k=top_k,
@@ -116,3 +146,29 @@ def search_cheeses(query, top_k=5):
     
     # Return results
     return search_results['matches']
+
+
+def search_cheeses_many(queries, top_k=5, filter=None):
+    """Search for several queries at once, returning one list of matches per query"""
+    if not queries:
+        return []
+    
+    config = get_config()
+    
+    # The configured vector store, loaded once per process
+    index = get_shared_vector_store()
+    
+    # Embed every query in token-packed batch requests
+    query_embeddings = create_embeddings(list(queries))
+    
+    # Concurrent queries (or a single matrix product on the local backend)
+    search_results = index.query_many(
+        query_embeddings,
+        top_k,
+        filter=filter,
+        include_metadata=True,
+        max_workers=config['vector_db'].get('query_concurrency', 8)
+    )
+    
+    # Return results aligned with the input queries
+    return [result['matches'] for result in search_results]
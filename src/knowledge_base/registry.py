@@ -0,0 +1,306 @@
+import asyncio
+import os
+import queue
+import re
+import threading
+import httpx
+import yaml
+from dotenv import load_dotenv
+
+# Process-wide caches: the config is parsed once per path and every client is built once,
+# so hot calls reuse the same keep-alive connections instead of new TLS handshakes.
+_lock = threading.RLock()
+_env_loaded = False
+_configs = {}
+_clients = {}
+_loop = None
+
+_ENV_PLACEHOLDER = re.compile(r"\$\{([^}]+)\}")
+
+DEFAULT_CONFIG_PATH = 'config/config.yaml'
+
+
+def _expand_env(value):
+    """Recursively replace ${VAR} placeholders with environment values"""
+    if isinstance(value, str):
+        return _ENV_PLACEHOLDER.sub(lambda match: os.getenv(match.group(1), ""), value)
+    if isinstance(value, dict):
+        return {key: _expand_env(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand_env(item) for item in value]
+    return value
+
+
+def _load_env():
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv()
+        _env_loaded = True
+
+
+def get_config(config_path=DEFAULT_CONFIG_PATH):
+    """Return the parsed config with ${...} placeholders expanded, loading it only once"""
+    key = os.path.abspath(config_path)
+    config = _configs.get(key)
+    if config is not None:
+        return config
+
+    with _lock:
+        if key not in _configs:
+            _load_env()
+            with open(config_path, 'r') as file:
+                _configs[key] = _expand_env(yaml.safe_load(file))
+        return _configs[key]
+
+
+def _cached(name, factory):
+    client = _clients.get(name)
+    if client is not None:
+        return client
+
+    with _lock:
+        if name not in _clients:
+            _clients[name] = factory()
+        return _clients[name]
+
+
+def _http_settings(config):
+    settings = config.get('clients', {}).get('http', {})
+    limits = httpx.Limits(
+        max_connections=settings.get('max_connections', 100),
+        max_keepalive_connections=settings.get('max_keepalive_connections', 20),
+        keepalive_expiry=settings.get('keepalive_expiry', 30)
+    )
+    timeout = httpx.Timeout(settings.get('timeout', 60), connect=settings.get('connect_timeout', 10))
+    return limits, timeout
+
+
+def get_http_client(config_path=DEFAULT_CONFIG_PATH):
+    """Shared httpx client with a tuned keep-alive connection pool"""
+    def factory():
+        limits, timeout = _http_settings(get_config(config_path))
+        return httpx.Client(limits=limits, timeout=timeout)
+
+    return _cached(('http', config_path), factory)
+
+
+def get_event_loop():
+    """The process-wide event loop, running in a daemon thread, shared by every async client"""
+    global _loop
+    if _loop is not None:
+        return _loop
+
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-runtime", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def _on_loop_thread(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+def run_sync(coroutine):
+    """Run a coroutine on the shared event loop and wait for its result (for the synchronous APIs)"""
+    loop = get_event_loop()
+    if _on_loop_thread(loop):
+        coroutine.close()
+        raise RuntimeError("Synchronous API called from the shared event loop; await the async variant instead")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+def iterate_sync(async_iterable):
+    """Iterate an async iterable from synchronous code.
+
+    The iterable is consumed by a single task on the shared event loop (so context
+    variables stay valid across its yields) and items are handed over through a queue.
+    Closing the generator early cancels that task.
+    """
+    loop = get_event_loop()
+    if _on_loop_thread(loop):
+        raise RuntimeError("Synchronous API called from the shared event loop; await the async variant instead")
+
+    items = queue.Queue()
+    finished = object()
+
+    async def pump():
+        try:
+            async for item in async_iterable:
+                items.put((item, None))
+        except Exception as e:
+            items.put((finished, e))
+        else:
+            items.put((finished, None))
+
+    future = asyncio.run_coroutine_threadsafe(pump(), loop)
+    try:
+        while True:
+            item, error = items.get()
+            if item is finished:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        future.cancel()
+
+
+def _versioned(name, version, factory):
+    """Like _cached, but the value is rebuilt whenever version changes"""
+    cached = _clients.get(name)
+    if cached is None or cached[0] != version:
+        with _lock:
+            cached = _clients.get(name)
+            if cached is None or cached[0] != version:
+                cached = _clients[name] = (version, factory())
+    return cached[1]
+
+
+def get_shared_vector_store(config_path=DEFAULT_CONFIG_PATH):
+    """Vector store for searching, loaded once per config and reloaded when its local files change"""
+    from .vector_store import get_vector_store, store_version
+    config = get_config(config_path)
+    return _versioned(('vector_store', config_path), store_version(config), lambda: get_vector_store(config))
+
+
+def get_vector_snapshot(config_path=DEFAULT_CONFIG_PATH):
+    """Local float32 snapshot written next to the Pinecone index at ingestion (None if absent),
+    shared by every retriever and reloaded when its files change"""
+    from .vector_store import LocalVectorStore, path_version
+    config = get_config(config_path)
+    path = config['vector_db'].get('local', {}).get('path')
+    if not path or not os.path.exists(os.path.join(path, 'embeddings.npy')):
+        return None
+    return _versioned(
+        ('vector_snapshot', config_path),
+        path_version(path),
+        lambda: LocalVectorStore(path, dimension=config['vector_db']['pinecone']['dimension'])
+    )
+
+
+def get_sqlite_pool(db_path, config_path=DEFAULT_CONFIG_PATH):
+    """Read-only connection pool for a SQLite database, one per file and shared by every retriever"""
+    def factory():
+        from ..rag.db_pool import SQLitePool
+        settings = get_config(config_path).get('sqlite', {})
+        return SQLitePool(
+            db_path,
+            pool_size=settings.get('pool_size', 8),
+            cached_statements=settings.get('cached_statements', 256),
+            in_memory=settings.get('in_memory', False)
+        )
+
+    return _cached(('sqlite_pool', os.path.abspath(db_path)), factory)
+
+
+def get_retrieval_cache(db_path, config_path=DEFAULT_CONFIG_PATH):
+    """Retrieval results cache shared by every retriever on the same catalog; entries are
+    tagged with the catalog version, so a rebuild invalidates them for all sessions at once"""
+    def factory():
+        from ..rag.cache import RetrievalCache
+        settings = get_config(config_path)['rag'].get('cache', {})
+        return RetrievalCache(
+            max_entries=settings.get('max_entries', 1000),
+            ttl_seconds=settings.get('ttl_seconds', 3600),
+            similarity_threshold=settings.get('similarity_threshold', 0.95)
+        )
+
+    return _cached(('retrieval_cache', config_path, os.path.abspath(db_path)), factory)
+
+
+def get_async_http_client(config_path=DEFAULT_CONFIG_PATH):
+    """Shared httpx async client, used from the shared event loop"""
+    def factory():
+        limits, timeout = _http_settings(get_config(config_path))
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    return _cached(('async_http', config_path), factory)
+
+
+def _api_key(config, name, env_var):
+    return config.get('api_keys', {}).get(name) or os.getenv(env_var)
+
+
+def get_openai_client(config_path=DEFAULT_CONFIG_PATH):
+    """Shared OpenAI client backed by the pooled HTTP client"""
+    def factory():
+        from openai import OpenAI
+        config = get_config(config_path)
+        return OpenAI(
+            api_key=_api_key(config, 'openai_api_key', "OPENAI_API_KEY"),
+            http_client=get_http_client(config_path)
+        )
+
+    return _cached(('openai', config_path), factory)
+
+
+def get_async_openai_client(config_path=DEFAULT_CONFIG_PATH):
+    """Shared AsyncOpenAI client backed by the pooled async HTTP client"""
+    def factory():
+        from openai import AsyncOpenAI
+        config = get_config(config_path)
+        return AsyncOpenAI(
+            api_key=_api_key(config, 'openai_api_key', "OPENAI_API_KEY"),
+            http_client=get_async_http_client(config_path)
+        )
+
+    return _cached(('async_openai', config_path), factory)
+
+
+def get_pinecone_client(config_path=DEFAULT_CONFIG_PATH):
+    """Shared Pinecone client"""
+    def factory():
+        from pinecone import Pinecone
+        config = get_config(config_path)
+        return Pinecone(
+            api_key=_api_key(config, 'pinecone_api_key', "PINECONE_API_KEY"),
+            pool_threads=config.get('clients', {}).get('pinecone_pool_threads', 4)
+        )
+
+    return _cached(('pinecone', config_path), factory)
+
+
+def get_pinecone_index(index_name=None, config_path=DEFAULT_CONFIG_PATH):
+    """Shared handle to a Pinecone index (defaults to vector_db.pinecone.index_name)"""
+    if index_name is None:
+        index_name = get_config(config_path)['vector_db']['pinecone']['index_name']
+
+    return _cached(
+        ('pinecone_index', config_path, index_name),
+        lambda: get_pinecone_client(config_path).Index(index_name)
+    )
+
+
+def get_pinecone_host(index_name=None, config_path=DEFAULT_CONFIG_PATH):
+    """Data-plane host of a Pinecone index, looked up once, for the async REST queries"""
+    if index_name is None:
+        index_name = get_config(config_path)['vector_db']['pinecone']['index_name']
+
+    return _cached(
+        ('pinecone_host', config_path, index_name),
+        lambda: get_pinecone_client(config_path).describe_index(index_name).host
+    )
+
+
+def get_pinecone_api_key(config_path=DEFAULT_CONFIG_PATH):
+    return _api_key(get_config(config_path), 'pinecone_api_key', "PINECONE_API_KEY")
+
+
+def reset():
+    """Drop every cached config and client (used when the config file changes)"""
+    global _env_loaded
+    with _lock:
+        for client in _clients.values():
+            close = getattr(client, 'close', None)
+            if isinstance(client, httpx.Client) and close:
+                close()
+            elif isinstance(client, httpx.AsyncClient) and _loop is not None:
+                asyncio.run_coroutine_threadsafe(client.aclose(), _loop)
+        _clients.clear()
+        _configs.clear()
+        _env_loaded = False
@@ -0,0 +1,208 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from .registry import DEFAULT_CONFIG_PATH, get_config
+
+# Histogram bucket upper bounds in milliseconds
+DEFAULT_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+# The innermost open span of the current thread or asyncio task
+_current_span = ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    """Returned when tracing is disabled so instrumented code costs almost nothing"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """One timed stage; spans opened inside it (also in child tasks) become its children"""
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = uuid.uuid4().hex[:16]
+
+    def set(self, **attrs):
+        """Attach attributes such as token counts or payload sizes"""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        _current_span.reset(self._token)
+        # Cancellation and generator shutdown are BaseExceptions, not errors
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer._finish(self)
+        return False
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+class Tracer:
+    """Nested spans written to a rotating JSONL file and aggregated into per-stage histograms"""
+    def __init__(self, enabled=False, path="logs/traces.jsonl", max_bytes=10 * 1024 * 1024,
+                 backup_count=5, buckets=None):
+        self.enabled = enabled
+        self.buckets = list(buckets or DEFAULT_BUCKETS_MS)
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._logger = None
+
+        if enabled and path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger(f"tracing.{os.path.abspath(path)}")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.handlers = [handler]
+
+    def span(self, name, **attrs):
+        """Context manager timing one stage: with tracer.span("embedding", chars=n) as span: ..."""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attrs)
+
+    def observe(self, name, duration_ms, **attrs):
+        """Record a duration measured by the caller (e.g. time to first token) under the current span"""
+        if not self.enabled:
+            return
+        span = Span(self, name, attrs)
+        span.start = time.time() - duration_ms / 1000
+        span.duration_ms = duration_ms
+        self._finish(span)
+
+    def _finish(self, span):
+        index = bisect.bisect_left(self.buckets, span.duration_ms)
+        with self._lock:
+            histogram = self.histograms.get(span.name)
+            if histogram is None:
+                histogram = self.histograms[span.name] = _Histogram(self.buckets)
+            histogram.counts[index] += 1
+            histogram.sum += span.duration_ms
+            histogram.count += 1
+
+        if self._logger is not None:
+            self._logger.info(json.dumps({
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "start": span.start,
+                "duration_ms": round(span.duration_ms, 3),
+                "attrs": span.attrs
+            }, default=str))
+
+    def percentile(self, name, q):
+        """Estimate of the q-quantile (0-1) of a stage's duration, interpolated within its bucket
+        like Prometheus' histogram_quantile"""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None or histogram.count == 0:
+                return None
+            counts = list(histogram.counts)
+            target = q * histogram.count
+
+        seen, lower = 0, 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and seen + count >= target:
+                return lower + (bound - lower) * (target - seen) / count
+            seen += count
+            lower = bound
+        # Beyond the last bucket the best estimate is its upper bound
+        return float(self.buckets[-1])
+
+    def summary(self):
+        """count, mean, p50 and p95 (ms) per stage"""
+        with self._lock:
+            names = {name: (histogram.count, histogram.sum) for name, histogram in self.histograms.items()}
+        return {
+            name: {
+                "count": count,
+                "mean_ms": total / count if count else 0.0,
+                "p50_ms": self.percentile(name, 0.50),
+                "p95_ms": self.percentile(name, 0.95)
+            }
+            for name, (count, total) in names.items()
+        }
+
+    def export_prometheus(self, metric="rag_stage_duration_ms"):
+        """Histograms in the Prometheus text exposition format"""
+        lines = [
+            f"# HELP {metric} Duration of question-answering stages in milliseconds",
+            f"# TYPE {metric} histogram"
+        ]
+        with self._lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{name}"}} {histogram.sum:.3f}')
+                lines.append(f'{metric}_count{{stage="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+def usage_attrs(response):
+    """Token counts from an OpenAI response, if it reports usage"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {}
+    return {
+        key: getattr(usage, key) for key in ("prompt_tokens", "completion_tokens", "total_tokens")
+        if getattr(usage, key, None) is not None
+    }
+
+
+_tracers = {}
+_tracers_lock = threading.Lock()
+
+
+def get_tracer(config_path=DEFAULT_CONFIG_PATH):
+    """Process-wide tracer configured under the tracing section (disabled if absent)"""
+    tracer = _tracers.get(config_path)
+    if tracer is not None:
+        return tracer
+
+    with _tracers_lock:
+        if config_path not in _tracers:
+            settings = get_config(config_path).get('tracing', {})
+            _tracers[config_path] = Tracer(
+                enabled=settings.get('enabled', False),
+                path=settings.get('path', 'logs/traces.jsonl'),
+                max_bytes=settings.get('max_bytes', 10 * 1024 * 1024),
+                backup_count=settings.get('backup_count', 5),
+                buckets=settings.get('buckets_ms')
+            )
+        return _tracers[config_path]
@@ -0,0 +1,470 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .filters import ColumnarMetadata
+
+
+class Match:
+    """A single search hit, readable both as attributes and as a dict like Pinecone's matches"""
+    def __init__(self, id, score, metadata=None, values=None):
+        self.id = id
+        self.score = score
+        self.metadata = metadata or {}
+        self.values = values
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def __repr__(self):
+        return f"Match(id={self.id!r}, score={self.score:.4f})"
+
+
+class QueryResult:
+    """Container mirroring the shape of a Pinecone query response"""
+    def __init__(self, matches):
+        self.matches = matches
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class VectorStore:
+    """Interface shared by the vector search backends used by the retriever"""
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        raise NotImplementedError
+
+    def query_many(self, vectors, top_k, filter=None, include_metadata=True, max_workers=8):
+        """Run several queries concurrently, returning results aligned with the input"""
+        if len(vectors) <= 1:
+            return [self.query(vector, top_k, filter=filter, include_metadata=include_metadata) for vector in vectors]
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(vectors))) as executor:
+            return list(executor.map(
+                lambda vector: self.query(vector, top_k, filter=filter, include_metadata=include_metadata),
+                vectors
+            ))
+
+    async def query_async(self, vector, top_k, filter=None, include_metadata=True):
+        """Async query; in-process stores run the scan on a worker thread"""
+        return await asyncio.to_thread(self.query, vector, top_k, filter=filter, include_metadata=include_metadata)
+
+    def fetch(self, ids):
+        """Stored values and metadata for the given ids, as {id: Match} (missing ids are left out)"""
+        raise NotImplementedError
+
+    async def fetch_async(self, ids):
+        return await asyncio.to_thread(self.fetch, ids)
+
+    def upsert(self, vectors):
+        raise NotImplementedError
+
+    def flush(self):
+        """Persist pending writes (no-op for remote backends)"""
+        pass
+
+    # Columnar view of self.metadata for stores that keep metadata in process
+    _columns = None
+
+    def filter_mask(self, filter):
+        """Boolean mask over self.metadata for a Pinecone-style filter (raises FilterError if invalid)"""
+        if self._columns is None or self._columns.size != len(self.metadata):
+            self._columns = ColumnarMetadata(self.metadata)
+        return self._columns.mask(filter)
+
+
+class PineconeVectorStore(VectorStore):
+    """Vector store backed by a Pinecone serverless index.
+
+    With host, api_key and an httpx.AsyncClient, query_async calls the index's REST
+    query endpoint directly on the event loop instead of borrowing a thread.
+    """
+    def __init__(self, index, host=None, api_key=None, http_client=None):
+        self.index = index
+        self.host = host
+        self.api_key = api_key
+        self.http_client = http_client
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        return self.index.query(
+            vector=vector,
+            top_k=top_k,
+            filter=filter,
+            include_metadata=include_metadata
+        )
+
+    async def query_async(self, vector, top_k, filter=None, include_metadata=True):
+        if not (self.host and self.http_client):
+            return await super().query_async(vector, top_k, filter=filter, include_metadata=include_metadata)
+
+        body = {
+            "vector": [float(value) for value in vector],
+            "topK": top_k,
+            "includeMetadata": include_metadata,
+            "includeValues": False
+        }
+        if filter:
+            body["filter"] = filter
+        response = await self.http_client.post(
+            f"https://{self.host}/query",
+            json=body,
+            headers={"Api-Key": self.api_key}
+        )
+        response.raise_for_status()
+        return QueryResult([
+            Match(match["id"], match.get("score"), metadata=match.get("metadata"))
+            for match in response.json().get("matches", [])
+        ])
+
+    def fetch(self, ids, batch_size=100):
+        """Batched fetch of stored vectors and metadata"""
+        found = {}
+        for start in range(0, len(ids), batch_size):
+            response = self.index.fetch(ids=list(ids[start:start + batch_size]))
+            for vector_id, vector in response.vectors.items():
+                found[vector_id] = Match(vector_id, None, metadata=vector.metadata or {}, values=vector.values)
+        return found
+
+    def upsert(self, vectors):
+        self.index.upsert(vectors=vectors)
+
+    def describe_index_stats(self):
+        return self.index.describe_index_stats()
+
+
+class LocalVectorStore(VectorStore):
+    """In-process vector store keeping normalized embeddings in a contiguous NumPy matrix"""
+    def __init__(self, path, dimension=1536):
+        self.path = path
+        self.dimension = dimension
+        self.ids = []
+        self.metadata = []
+        self.matrix = np.zeros((0, dimension), dtype=np.float32)
+        self._positions = {}
+
+        if os.path.exists(self._embeddings_path()):
+            self.load()
+
+    def _embeddings_path(self):
+        return os.path.join(self.path, "embeddings.npy")
+
+    def _metadata_path(self):
+        return os.path.join(self.path, "metadata.json")
+
+    def load(self):
+        """Load embeddings and metadata from disk"""
+        self.matrix = np.ascontiguousarray(np.load(self._embeddings_path()), dtype=np.float32)
+        with open(self._metadata_path(), 'r') as f:
+            stored = json.load(f)
+        self.ids = stored["ids"]
+        self.metadata = stored["metadata"]
+        self._positions = {vector_id: i for i, vector_id in enumerate(self.ids)}
+        self._columns = None
+
+    def flush(self):
+        """Write embeddings and metadata to disk"""
+        os.makedirs(self.path, exist_ok=True)
+        np.save(self._embeddings_path(), self.matrix)
+        with open(self._metadata_path(), 'w') as f:
+            json.dump({"ids": self.ids, "metadata": self.metadata}, f)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def fetch(self, ids):
+        found = {}
+        for vector_id in ids:
+            position = self._positions.get(vector_id)
+            if position is not None:
+                found[vector_id] = Match(vector_id, None, metadata=self.metadata[position], values=self.matrix[position])
+        return found
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def upsert(self, vectors):
+        """Insert or replace vectors given as Pinecone-style dicts (id, values, metadata)"""
+        new_rows = []
+        for vector in vectors:
+            row = self._normalize(vector["values"])
+            position = self._positions.get(vector["id"])
+            if position is not None:
+                # The id may have been appended earlier in this same batch
+                appended = position - len(self.matrix)
+                if appended >= 0:
+                    new_rows[appended] = row
+                else:
+                    self.matrix[position] = row
+                self.metadata[position] = vector.get("metadata", {})
+            else:
+                # Row index once new_rows is stacked under the current matrix
+                self._positions[vector["id"]] = len(self.ids)
+                self.ids.append(vector["id"])
+                self.metadata.append(vector.get("metadata", {}))
+                new_rows.append(row)
+
+        if new_rows:
+            self.matrix = np.ascontiguousarray(np.vstack([self.matrix] + new_rows), dtype=np.float32)
+        self._columns = None
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        """Return the top_k matches by cosine similarity, optionally restricted by a metadata filter"""
+        if not self.ids:
+            return QueryResult([])
+
+        vector = self._normalize(vector)
+
+        if filter:
+            # Score only the rows that pass the filter
+            rows = np.flatnonzero(self.filter_mask(filter))
+            scores = self.matrix[rows] @ vector
+        else:
+            rows = None
+            scores = self.matrix @ vector
+
+        k = min(top_k, len(scores))
+        if k <= 0:
+            return QueryResult([])
+
+        # Partial selection of the top k, then sort only those
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        positions = rows[top] if rows is not None else top
+
+        return QueryResult([
+            Match(
+                id=self.ids[i],
+                score=float(score),
+                metadata=self.metadata[i] if include_metadata else None
+            )
+            for i, score in zip(positions, scores[top])
+        ])
+
+
+    def query_many(self, vectors, top_k, filter=None, include_metadata=True, max_workers=8):
+        """Score every query with one matrix product and select the top_k per row"""
+        if not self.ids or len(vectors) == 0:
+            return [QueryResult([]) for _ in vectors]
+
+        if filter:
+            rows = np.flatnonzero(self.filter_mask(filter))
+            scores = self._normalize(vectors) @ self.matrix[rows].T
+        else:
+            rows = np.arange(len(self.ids))
+            scores = self._normalize(vectors) @ self.matrix.T
+
+        k = min(top_k, len(rows))
+        if k <= 0:
+            return [QueryResult([]) for _ in vectors]
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        return [
+            QueryResult([
+                Match(
+                    id=self.ids[i],
+                    score=float(score),
+                    metadata=self.metadata[i] if include_metadata else None
+                )
+                for i, score in zip(rows[row], row_scores)
+            ])
+            for row, row_scores in zip(top, top_scores)
+        ]
+
+
+class QuantizedVectorStore(VectorStore):
+    """Read-only store scanning memory-mapped int8/float16 vectors, then re-ranking exactly in float32
+
+    Both the quantized codes and the float32 embeddings are opened with mmap_mode='r', so
+    the pages are shared between worker processes through the OS page cache and only the
+    quantized matrix is touched on every query.
+    """
+    def __init__(self, path, rerank_factor=4, chunk_size=16384):
+        self.path = path
+        self.rerank_factor = rerank_factor
+        self.chunk_size = chunk_size
+
+        with open(os.path.join(path, "quantized.json"), 'r') as f:
+            info = json.load(f)
+        self.dtype = info["dtype"]
+
+        self.codes = np.load(os.path.join(path, "quantized.npy"), mmap_mode='r')
+        self.scales = np.load(os.path.join(path, "scales.npy"))
+        self.full = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+
+        with open(os.path.join(path, "metadata.json"), 'r') as f:
+            stored = json.load(f)
+        self.ids = stored["ids"]
+        self.metadata = stored["metadata"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, vectors):
+        raise NotImplementedError("QuantizedVectorStore is read-only; rebuild it with build_quantized_store")
+
+    def _coarse_scores(self, vector):
+        """Approximate scores from the quantized matrix, scanned in chunks to bound temporaries"""
+        query = (vector * self.scales).astype(np.float32)
+        scores = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), self.chunk_size):
+            chunk = self.codes[start:start + self.chunk_size]
+            scores[start:start + len(chunk)] = chunk.astype(np.float32) @ query
+        return scores
+
+    def query(self, vector, top_k, filter=None, include_metadata=True):
+        """Coarse quantized scan followed by exact float32 re-ranking of the best candidates"""
+        if not self.ids:
+            return QueryResult([])
+
+        vector = LocalVectorStore._normalize(vector)
+        scores = self._coarse_scores(vector)
+
+        if filter:
+            mask = self.filter_mask(filter)
+            candidates = int(mask.sum())
+            scores = np.where(mask, scores, -np.inf)
+        else:
+            candidates = len(self.ids)
+
+        k = min(top_k, candidates)
+        if k <= 0:
+            return QueryResult([])
+
+        # Shortlist on the quantized scores
+        shortlist_size = min(k * self.rerank_factor, candidates)
+        shortlist = np.argpartition(-scores, shortlist_size - 1)[:shortlist_size]
+        shortlist.sort()
+
+        # Exact re-rank reads only the shortlisted rows from the float32 file
+        exact = np.asarray(self.full[shortlist], dtype=np.float32) @ vector
+        order = np.argsort(-exact)[:k]
+
+        return QueryResult([
+            Match(
+                id=self.ids[shortlist[i]],
+                score=float(exact[i]),
+                metadata=self.metadata[shortlist[i]] if include_metadata else None
+            )
+            for i in order
+        ])
+
+
+def build_quantized_store(path, dtype="int8"):
+    """Quantize the float32 snapshot at path into a memory-mappable int8 or float16 matrix"""
+    full = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+
+    if dtype == "int8":
+        # Symmetric per-dimension scale so each column uses the full int8 range
+        scales = np.abs(full).max(axis=0).astype(np.float32) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(full / scales), -127, 127).astype(np.int8)
+    elif dtype == "float16":
+        scales = np.ones(full.shape[1], dtype=np.float32)
+        codes = full.astype(np.float16)
+    else:
+        raise ValueError(f"Unsupported quantization dtype: {dtype}")
+
+    np.save(os.path.join(path, "quantized.npy"), codes)
+    np.save(os.path.join(path, "scales.npy"), scales)
+    with open(os.path.join(path, "quantized.json"), 'w') as f:
+        json.dump({"dtype": dtype, "count": int(full.shape[0]), "dimension": int(full.shape[1])}, f)
+
+    print(f"Built {dtype} quantized store for {full.shape[0]} vectors "
+          f"({codes.nbytes / 1e6:.2f} MB vs {full.nbytes / 1e6:.2f} MB float32)")
+
+
+def evaluate_recall(exact_store, candidate_store, queries, k=5):
+    """Mean recall@k of candidate_store against exact float32 search over the same vectors"""
+    if len(queries) == 0:
+        return 1.0
+
+    hits = 0
+    for query in queries:
+        expected = {match.id for match in exact_store.query(query, k, include_metadata=False).matches}
+        found = {match.id for match in candidate_store.query(query, k, include_metadata=False).matches}
+        hits += len(expected & found) / max(len(expected), 1)
+    return hits / len(queries)
+
+
+def sample_queries(store, n=100, noise=0.05, seed=0):
+    """Perturbed copies of stored vectors, used as synthetic queries for recall checks"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(store), size=min(n, len(store)), replace=False)
+    queries = np.asarray(store.matrix[rows], dtype=np.float32)
+    return queries + rng.normal(scale=noise, size=queries.shape).astype(np.float32)
+
+
+def path_version(path):
+    """Latest modification time of the files in a store directory (None if it doesn't exist)"""
+    try:
+        return max((entry.stat().st_mtime_ns for entry in os.scandir(path) if entry.is_file()), default=None)
+    except FileNotFoundError:
+        return None
+
+
+def store_version(config):
+    """path_version of the configured local store's directory (None for Pinecone)"""
+    if config['vector_db'].get('backend', 'pinecone') != 'local':
+        return None
+    local_config = config['vector_db']['local']
+    return path_version(local_config['ann']['path'] if local_config.get('index', 'flat') == 'ivfpq' else local_config['path'])
+
+
+def get_vector_store(config, create=False):
+    """Return the vector store configured under vector_db.backend"""
+    backend = config['vector_db'].get('backend', 'pinecone')
+
+    if backend == 'local':
+        local_config = config['vector_db']['local']
+        if local_config.get('index', 'flat') == 'ivfpq':
+            from .ann_index import IVFPQIndex
+            ann_config = local_config['ann']
+            return IVFPQIndex(
+                ann_config['path'],
+                dimension=config['vector_db']['pinecone']['dimension'],
+                nlist=ann_config.get('nlist', 0),
+                m=ann_config.get('m', 16),
+                nprobe=ann_config.get('nprobe', 8),
+                refine_factor=ann_config.get('refine_factor', 10)
+            )
+
+        quantization = local_config.get('quantization', 'none')
+        if quantization != 'none' and not create:
+            return QuantizedVectorStore(
+                local_config['path'],
+                rerank_factor=local_config.get('rerank_factor', 4)
+            )
+        return LocalVectorStore(
+            config['vector_db']['local']['path'],
+            dimension=config['vector_db']['pinecone']['dimension']
+        )
+
+    if backend == 'pinecone':
+        if create:
+            from .pinecone_client import create_pinecone_index
+            return PineconeVectorStore(create_pinecone_index())
+
+        from .registry import get_async_http_client, get_pinecone_api_key, get_pinecone_host, get_pinecone_index
+        index_name = config['vector_db']['pinecone']['index_name']
+        return PineconeVectorStore(
+            get_pinecone_index(index_name),
+            host=get_pinecone_host(index_name),
+            api_key=get_pinecone_api_key(),
+            http_client=get_async_http_client()
+        )
+
+    raise ValueError(f"Unknown vector_db backend: {backend}")
@@ -0,0 +1,143 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_question(question):
+    """Lowercase words only, so punctuation and spacing differences share a cache entry"""
+    return " ".join(_WORD_PATTERN.findall(question.lower()))
+
+
+def catalog_version(*paths):
+    """Cheap fingerprint of the catalog files (size and mtime), changes whenever they are rebuilt"""
+    version = []
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                stat = os.stat(os.path.join(path, name))
+                version.append((name, stat.st_size, stat.st_mtime_ns))
+        else:
+            stat = os.stat(path)
+            version.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(version)
+
+
+class RetrievalCache:
+    """LRU/TTL cache of retrieval results keyed by normalized question, with a semantic fallback.
+
+    get() matches the normalized question exactly; get_similar() compares a query
+    embedding with the cached ones and accepts the best match above similarity_threshold.
+    Entries from an older catalog version are never returned.
+    """
+    def __init__(self, max_entries=1000, ttl_seconds=3600, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._matrix_keys = []
+
+    def _check_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self._matrix = None
+            self.version = version
+
+    def _live(self, key, entry, now):
+        if now - entry["created"] > self.ttl_seconds:
+            del self.entries[key]
+            self._matrix = None
+            return False
+        return True
+
+    def _result(self, key, entry, top_k):
+        self.entries.move_to_end(key)
+        return [dict(document) for document in entry["results"][:top_k]]
+
+    def get(self, question, top_k, version):
+        """Results cached for the same normalized question, or None"""
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version(version)
+            entry = self.entries.get(key)
+            if entry is not None and self._live(key, entry, time.time()) and entry["top_k"] >= top_k:
+                self.hits["exact"] += 1
+                return self._result(key, entry, top_k)
+            return None
+
+    def get_similar(self, question, embedding, top_k, version):
+        """Results of the most similar cached question above the threshold, or None.
+
+        Numbers in the question must match exactly, since "under $20" and "under $30"
+        embed almost identically but filter differently.
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        numbers = _NUMBER_PATTERN.findall(question)
+
+        with self._lock:
+            self._check_version(version)
+            if self._matrix is None:
+                self._matrix_keys = [key for key, entry in self.entries.items() if entry["embedding"] is not None]
+                self._matrix = np.stack([self.entries[key]["embedding"] for key in self._matrix_keys]) \
+                    if self._matrix_keys else np.zeros((0, len(query)), dtype=np.float32)
+
+            keys = self._matrix_keys
+            scores = self._matrix @ query
+            now = time.time()
+            for position in np.argsort(-scores):
+                if scores[position] < self.similarity_threshold:
+                    break
+                key = keys[position]
+                entry = self.entries.get(key)
+                if entry is None or not self._live(key, entry, now):
+                    continue
+                if entry["top_k"] >= top_k and entry["numbers"] == numbers:
+                    self.hits["semantic"] += 1
+                    return self._result(key, entry, top_k)
+            self.misses += 1
+            return None
+
+    def put(self, question, embedding, results, top_k, version):
+        key = normalize_question(question)
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+
+        with self._lock:
+            self._check_version(version)
+            self.entries[key] = {
+                "embedding": embedding,
+                "numbers": _NUMBER_PATTERN.findall(question),
+                "results": [dict(document) for document in results],
+                "top_k": top_k,
+                "created": time.time()
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            hits = sum(self.hits.values())
+            total = hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "exact_hits": self.hits["exact"],
+                "semantic_hits": self.hits["semantic"],
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0
+            }
@@ -0,0 +1,60 @@
+import json
+import re
+from ..knowledge_base.embeddings import count_tokens
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def _title_words(document):
+    return set(_WORD_PATTERN.findall(str(document["metadata"].get("title", "")).lower()))
+
+
+def is_near_duplicate(document, other, threshold=0.9):
+    """Same UPC or URL, or titles whose word sets overlap by at least threshold (Jaccard)"""
+    metadata, other_metadata = document["metadata"], other["metadata"]
+    for field in ("upc", "url"):
+        if metadata.get(field) and metadata.get(field) == other_metadata.get(field):
+            return True
+
+    words, other_words = _title_words(document), _title_words(other)
+    if not words or not other_words:
+        return False
+    return len(words & other_words) / len(words | other_words) >= threshold
+
+
+def format_document(document):
+    """Compact JSON for one product: metadata without empty values or the duplicated text field"""
+    metadata = {
+        key: value for key, value in document["metadata"].items()
+        if key != "text" and value not in ("", None, 0, [])
+    }
+    return json.dumps({"text": document.get("text", ""), "metadata": metadata}, separators=(",", ":"))
+
+
+def select_context(documents, similarity_threshold=0.3, max_tokens=6000, model="gpt-4o",
+                   duplicate_threshold=0.9, min_documents=1):
+    """Pick the documents that go into the answer prompt.
+
+    Matches below similarity_threshold are dropped (documents without a vector score, such
+    as lexical-only hybrid hits, are kept), near-duplicate products are removed, and the
+    rest fill a max_tokens budget in retrieval order. The best min_documents are kept even if
+    they score below the threshold. Returns (selected documents, context string, tokens).
+    """
+    # Documents arrive ranked by the retriever (cosine score, or fused rank in hybrid mode)
+    selected, parts, total = [], [], 0
+    for rank, document in enumerate(documents):
+        score = document.get("score")
+        if score is not None and score < similarity_threshold and rank >= min_documents:
+            continue
+        if any(is_near_duplicate(document, kept, duplicate_threshold) for kept in selected):
+            continue
+
+        text = format_document(document)
+        tokens = count_tokens(text, model)
+        if selected and total + tokens > max_tokens:
+            continue
+        selected.append(document)
+        parts.append(text)
+        total += tokens
+
+    return selected, "[" + ",\n".join(parts) + "]", total
@@ -1,43 +1,177 @@
+# Run from the project root with: python -m src.rag.create_db
+import argparse
+import ast
+import re
 import sqlite3
 import os
 import json
-import yaml
-from pinecone import Pinecone
-from dotenv import load_dotenv
-
-def create_cheese_database():
-    """Create a SQLite database for cheese metadata from Pinecone."""
-    # Load environment variables and config
-    load_dotenv()
-    
-    # Load configuration
-    with open('config/config.yaml', 'r') as file:
-        config = yaml.safe_load(file)
-    
-    # Create data directory if it doesn't exist
-    os.makedirs('data', exist_ok=True)
-    
-    # Initialize database
-    db_path = 'data/cheese.db'
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Create table with all needed fields
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ..knowledge_base.data_processor import process_cheese_data
+from ..knowledge_base.registry import get_pinecone_index
+
+DB_PATH = 'data/cheese.db'
+CATALOG_PATH = 'data/image-processed/cheese_data_with_image_descriptions.json'
+
+CHEESE_COLUMNS = [
+    "id", "title", "description", "brand", "origin", "color", "texture",
+    "price_per_unit", "case_price", "each_price", "each_weight", "case_weight",
+    "milk_type", "flavor_profile", "sku", "upc", "image_urls", "url",
+    "related_items", "use_cases", "vector_id", "keywords"
+]
+
+# Every column the SQL generator filters on gets its own index
+INDEXED_COLUMNS = [
+    "brand", "origin", "texture", "color", "milk_type",
+    "each_price", "price_per_unit", "each_weight", "upc"
+]
+
+# Multi-valued attributes live in child tables: (table, value column, metadata field)
+CHILD_TABLES = [
+    ("cheese_use_case", "use_case", "use_cases"),
+    ("cheese_keyword", "keyword", "keywords"),
+    ("cheese_category", "category", "all_categories"),
+]
+
+# Facets summarised at build time: (field, table, column) for categorical values
+# and the numeric columns that get histograms
+FACET_FIELDS = [
+    ("brand", "cheese", "brand"),
+    ("origin", "cheese", "origin"),
+    ("texture", "cheese", "texture"),
+    ("color", "cheese", "color"),
+    ("milk_type", "cheese", "milk_type"),
+    ("use_case", "cheese_use_case", "use_case"),
+    ("category", "cheese_category", "category"),
+]
+HISTOGRAM_FIELDS = ["each_price", "price_per_unit", "each_weight"]
+HISTOGRAM_BUCKETS = 10
+
+# "cooking, sandwiches, and various recipes" leaves a conjunction on the last item
+_LEADING_CONJUNCTION = re.compile(r"^(?:and|or)\s+", re.IGNORECASE)
+
+def _clean_item(item):
+    """Strip whitespace and a leading "and"/"or" from a text list item"""
+    if not isinstance(item, str):
+        return item
+    return _LEADING_CONJUNCTION.sub('', item.strip()).strip()
+
+def _split_list(value):
+    """Normalize a list-valued metadata field (list, comma-joined string or list repr) to a list"""
+    if not value:
+        return []
+    if not isinstance(value, list):
+        value = str(value).strip()
+        parsed = None
+        if value.startswith('['):
+            try:
+                parsed = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                pass
+        value = parsed if isinstance(parsed, list) else value.split(',')
+    items = [_clean_item(item) for item in value]
+    return [item for item in items if not isinstance(item, str) or item]
+
+def _related_rows(metadata, cheese_id):
+    rows = []
+    for item in _split_list(metadata.get('related_items')):
+        if isinstance(item, dict) and item.get('url'):
+            rows.append((cheese_id, item['url'], item.get('name', ''), 'related'))
+    for url in _split_list(metadata.get('others_you_may_like_urls')):
+        rows.append((cheese_id, url, '', 'others_you_may_like'))
+    return rows
+
+def _child_rows(metadata, cheese_id):
+    """Rows for every child table, keyed by table name"""
+    rows = {}
+    for table, _, field in CHILD_TABLES:
+        values = _split_list(metadata.get(field) or (metadata.get('category') if field == 'all_categories' else None))
+        unique = dict.fromkeys(str(value).strip().lower() for value in values if str(value).strip())
+        rows[table] = [(cheese_id, value) for value in unique]
+    rows["cheese_related"] = _related_rows(metadata, cheese_id)
+    return rows
+
+def _row_from_metadata(metadata, vector_id):
+    """Map one product's processed metadata to a cheese table row"""
+    return (
+        metadata.get('id', vector_id),
+        metadata.get('title', ''),
+        metadata.get('text', ''),
+        metadata.get('brand', ''),
+        metadata.get('origin', ''),
+        metadata.get('color', ''),
+        metadata.get('texture', ''),
+        float(metadata.get('price_per_unit', 0.0) or 0.0),
+        float(metadata.get('case_price', 0.0) or 0.0),
+        float(metadata.get('each_price', 0.0) or 0.0),
+        float(metadata.get('each_weight', 0.0) or 0.0),
+        float(metadata.get('case_weight', 0.0) or 0.0),
+        metadata.get('milk_type', ''),
+        metadata.get('flavor_profile', ''),
+        metadata.get('sku', ''),
+        metadata.get('upc', ''),
+        json.dumps(_split_list(metadata.get('image_urls'))),
+        metadata.get('url', ''),
+        json.dumps(_split_list(metadata.get('related_items'))),
+        json.dumps(_split_list(metadata.get('use_cases'))),
+        vector_id,
+        json.dumps(_split_list(metadata.get('keywords')))
+    )
+
+# Free-text columns searchable through the cheese_fts full-text index
+FTS_COLUMNS = ["title", "description", "keywords", "use_cases", "categories"]
+
+def _as_text(value):
+    """Plain text for the full-text index (lists are joined, JSON encoding is avoided)"""
+    if isinstance(value, list):
+        return ', '.join(str(item) for item in value)
+    return str(value or '')
+
+def _fts_row_from_metadata(metadata):
+    """Map one product's processed metadata to a cheese_fts row"""
+    return (
+        metadata.get('upc', ''),
+        metadata.get('title', ''),
+        metadata.get('text', ''),
+        _as_text(metadata.get('keywords')),
+        _as_text(metadata.get('use_cases')),
+        _as_text(metadata.get('all_categories') or metadata.get('category'))
+    )
+
+def load_processed_data(source=CATALOG_PATH):
+    """Load processed records from the catalog JSON or from a JSONL journal of processed records"""
+    if source.endswith('.jsonl'):
+        with open(source, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    with open(source, 'r') as f:
+        return process_cheese_data(json.load(f))
+
+def _create_schema(cursor):
+    cursor.execute('DROP TABLE IF EXISTS cheese_histogram')
+    cursor.execute('DROP TABLE IF EXISTS cheese_facet')
+    cursor.execute('DROP TABLE IF EXISTS cheese_fts')
+    cursor.execute('DROP TABLE IF EXISTS cheese_related')
+    for table, _, _ in CHILD_TABLES:
+        cursor.execute(f'DROP TABLE IF EXISTS {table}')
+    cursor.execute('DROP TABLE IF EXISTS cheese')
+    # Categorical text columns compare case-insensitively so '=' stays an index lookup
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS cheese (
+    CREATE TABLE cheese (
         id TEXT PRIMARY KEY,
         title TEXT,
         description TEXT,
-        brand TEXT,
-        origin TEXT,
-        color TEXT,
-        texture TEXT,
+        brand TEXT COLLATE NOCASE,
+        origin TEXT COLLATE NOCASE,
+        color TEXT COLLATE NOCASE,
+        texture TEXT COLLATE NOCASE,
         price_per_unit REAL,
         case_price REAL,
         each_price REAL,
         each_weight REAL,
         case_weight REAL,
-        milk_type TEXT,
+        milk_type TEXT COLLATE NOCASE,
         flavor_profile TEXT,
         sku TEXT,
         upc TEXT,
@@ -49,76 +183,264 @@ def create_cheese_database():
         keywords TEXT
     )
     ''')
-    
-    # Connect to Pinecone
-    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-    index_name = config['vector_db']['pinecone']['index_name']
-    index = pc.Index(index_name)
-    
-    print(f"Connected to Pinecone index: {index_name}")
-    
-    # Get all vector IDs from Pinecone
-    stats = index.describe_index_stats()
-    total_vectors = stats.total_vector_count
-    print(f"Total vectors in Pinecone: {total_vectors}")
-    
-    # Fetch all vectors (for small datasets) or paginate for larger ones
-    # This is a simplified approach - for very large datasets you'd need pagination
-    try:
-        # Query a small sample first to get IDs
-        sample_results = index.query(
-            vector=[0.1] * 1536,  # Dummy vector
-            top_k=min(10000, total_vectors),
-            include_metadata=True
+    for table, column, _ in CHILD_TABLES:
+        cursor.execute(f'''
+        CREATE TABLE {table} (
+            cheese_id TEXT NOT NULL REFERENCES cheese(id) ON DELETE CASCADE,
+            {column} TEXT NOT NULL COLLATE NOCASE,
+            PRIMARY KEY (cheese_id, {column})
+        )
+        ''')
+    cursor.execute('''
+    CREATE TABLE cheese_related (
+        cheese_id TEXT NOT NULL REFERENCES cheese(id) ON DELETE CASCADE,
+        related_url TEXT NOT NULL,
+        related_name TEXT,
+        relation TEXT NOT NULL,
+        PRIMARY KEY (cheese_id, related_url, relation)
+    )
+    ''')
+    # Full-text index replacing leading-wildcard LIKE scans; upc joins back to cheese
+    cursor.execute(f'''
+    CREATE VIRTUAL TABLE cheese_fts USING fts5(
+        upc UNINDEXED,
+        {', '.join(FTS_COLUMNS)},
+        tokenize = 'porter unicode61'
+    )
+    ''')
+    # Facet summaries used for prompt grounding, filter validation and UI widgets
+    cursor.execute('''
+    CREATE TABLE cheese_facet (
+        field TEXT NOT NULL,
+        value TEXT NOT NULL COLLATE NOCASE,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (field, value)
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE cheese_histogram (
+        field TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        lower REAL NOT NULL,
+        upper REAL NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (field, bucket)
+    )
+    ''')
+
+def _create_indexes(cursor):
+    # Built after the bulk insert, which is much faster than maintaining them row by row
+    for column in INDEXED_COLUMNS:
+        cursor.execute(f'CREATE INDEX idx_cheese_{column} ON cheese ({column})')
+    # Value lookups on the child tables (cheese_id lookups use their primary keys)
+    for table, column, _ in CHILD_TABLES:
+        cursor.execute(f'CREATE INDEX idx_{table}_{column} ON {table} ({column}, cheese_id)')
+    cursor.execute('CREATE INDEX idx_cheese_related_url ON cheese_related (related_url)')
+
+def _build_facets(cursor):
+    """Summarise categorical values with counts and numeric columns as equal-width histograms"""
+    for field, table, column in FACET_FIELDS:
+        cursor.execute(f'''
+        INSERT INTO cheese_facet (field, value, count)
+        SELECT ?, {column}, COUNT(*) FROM {table}
+        WHERE {column} IS NOT NULL AND TRIM({column}) != ''
+        GROUP BY {column}
+        ''', (field,))
+
+    for field in HISTOGRAM_FIELDS:
+        values = [row[0] for row in cursor.execute(f'SELECT {field} FROM cheese WHERE {field} IS NOT NULL')]
+        if not values:
+            continue
+        low, high = min(values), max(values)
+        width = (high - low) / HISTOGRAM_BUCKETS or 1.0
+        counts = [0] * HISTOGRAM_BUCKETS
+        for value in values:
+            counts[min(int((value - low) / width), HISTOGRAM_BUCKETS - 1)] += 1
+        cursor.executemany(
+            'INSERT INTO cheese_histogram (field, bucket, lower, upper, count) VALUES (?, ?, ?, ?, ?)',
+            [(field, i, low + i * width, low + (i + 1) * width, count) for i, count in enumerate(counts)]
         )
-        
-        # Process and insert data
-        count = 0
-        for match in sample_results.matches:
-            metadata = match.metadata
-            vector_id = match.id
-            print(vector_id)
-            # Extract all relevant fields, defaulting to appropriate empty values
-            cursor.execute('''
-            INSERT OR REPLACE INTO cheese VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                metadata.get('id', vector_id),
-                metadata.get('title', ''),
-                metadata.get('text', ''),
-                metadata.get('brand', ''),
-                metadata.get('origin', ''),
-                metadata.get('color', ''),
-                metadata.get('texture', ''),
-                float(metadata.get('price_per_unit', 0.0) or 0.0),
-                float(metadata.get('case_price', 0.0) or 0.0),
-                float(metadata.get('each_price', 0.0) or 0.0),
-                float(metadata.get('each_weight', 0.0) or 0.0),
-                float(metadata.get('case_weight', 0.0) or 0.0),
-                metadata.get('milk_type', ''),
-                metadata.get('flavor_profile', ''),
-                metadata.get('sku', ''),
-                metadata.get('upc', ''),
-                json.dumps(metadata.get('image_urls', [])),
-                metadata.get('url', ''),
-                json.dumps(metadata.get('related_items', [])),
-                json.dumps(metadata.get('use_cases', [])),
-                vector_id,
-                json.dumps(metadata.get('keywords', []))
-            ))
-            
-            count += 1
-            if count % 100 == 0:
-                print(f"Processed {count} records...")
-        
-        conn.commit()
-        print(f"Successfully imported {count} records to SQLite database at {db_path}")
-        
+
+def _fresh_build_path(db_path, suffix):
+    """Temporary file next to db_path, with leftovers from an interrupted build removed"""
+    tmp_path = db_path + suffix
+    for extension in ('', '-wal', '-shm'):
+        if os.path.exists(tmp_path + extension):
+            os.remove(tmp_path + extension)
+    return tmp_path
+
+def _open_for_bulk_load(db_path):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = -65536')
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
+
+def _finish_bulk_load(conn):
+    conn.execute("INSERT INTO cheese_fts (cheese_fts) VALUES ('optimize')")
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    # Fold the WAL back into the main file and leave it in rollback-journal mode, so
+    # read-only readers see a single file and never create -wal/-shm files next to it
+    # (a stale -wal left beside db_path would be applied to the file that replaces it)
+    conn.execute('PRAGMA journal_mode = DELETE')
+    conn.close()
+
+def _insert_records(cursor, records):
+    """Insert (vector_id, metadata) pairs into cheese, its child tables and cheese_fts"""
+    rows = []
+    fts_rows = []
+    child_rows = {table: [] for table, _, _ in CHILD_TABLES}
+    child_rows["cheese_related"] = []
+    for vector_id, metadata in records:
+        row = _row_from_metadata(metadata, vector_id)
+        rows.append(row)
+        fts_rows.append(_fts_row_from_metadata(metadata))
+        for table, table_rows in _child_rows(metadata, row[0]).items():
+            child_rows[table].extend(table_rows)
+
+    placeholders = ', '.join('?' for _ in CHEESE_COLUMNS)
+    cursor.executemany(f'INSERT OR REPLACE INTO cheese VALUES ({placeholders})', rows)
+    for table, _, _ in CHILD_TABLES:
+        cursor.executemany(f'INSERT OR IGNORE INTO {table} VALUES (?, ?)', child_rows[table])
+    cursor.executemany('INSERT OR IGNORE INTO cheese_related VALUES (?, ?, ?, ?)', child_rows["cheese_related"])
+    cursor.executemany(
+        'INSERT INTO cheese_fts (upc, title, description, keywords, use_cases, categories) VALUES (?, ?, ?, ?, ?, ?)',
+        fts_rows
+    )
+    return len(rows)
+
+def create_cheese_database(processed_data=None, db_path=DB_PATH, source=CATALOG_PATH):
+    """Rebuild the SQLite cheese database from processed catalog data in one transaction.
+
+    The database is built in a temporary file that atomically replaces db_path, so
+    connections already open on the old file keep reading a consistent copy.
+    """
+    start = time.perf_counter()
+
+    if processed_data is None:
+        processed_data = load_processed_data(source)
+
+    # Row ids match the vector ids assigned by upsert_to_pinecone
+    records = [(f"cheese_{i}", item['metadata']) for i, item in enumerate(processed_data)]
+
+    # Create data directory if it doesn't exist
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    tmp_path = _fresh_build_path(db_path, '.build')
+
+    conn = _open_for_bulk_load(tmp_path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN')
+        _create_schema(cursor)
+        count = _insert_records(cursor, records)
+        _create_indexes(cursor)
+        _build_facets(cursor)
+        cursor.execute('COMMIT')
     except Exception as e:
         print(f"Error importing data: {e}")
-        conn.rollback()
-    
-    finally:
+        cursor.execute('ROLLBACK')
+        conn.close()
+        raise
+
+    _finish_bulk_load(conn)
+    os.replace(tmp_path, db_path)
+
+    elapsed = time.perf_counter() - start
+    print(f"Successfully imported {count} records to SQLite database at {db_path} "
+          f"in {elapsed * 1000:.1f} ms")
+    return count
+
+def export_from_pinecone(db_path=DB_PATH, prefix="cheese_", page_size=100, fetch_batch_size=100,
+                         max_workers=4, commit_every=1000):
+    """Mirror the whole Pinecone index into SQLite, streaming pages of ids and bounded metadata fetches.
+
+    Ids are enumerated with the index's list API and metadata is fetched in batches of
+    fetch_batch_size on a thread pool, with at most 2 * max_workers fetches in flight so
+    memory stays bounded at any index size. Rows are committed every commit_every records
+    into a temporary file that atomically replaces db_path once the export is complete.
+    """
+    index = get_pinecone_index()
+    total = index.describe_index_stats().total_vector_count
+    print(f"Exporting {total} vectors from Pinecone")
+
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    tmp_path = _fresh_build_path(db_path, '.export')
+
+    conn = _open_for_bulk_load(tmp_path)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    _create_schema(cursor)
+
+    def fetch(ids):
+        response = index.fetch(ids=ids)
+        return [(vector_id, response.vectors[vector_id].metadata or {})
+                for vector_id in ids if vector_id in response.vectors]
+
+    def id_batches():
+        for page in index.list(prefix=prefix, limit=page_size):
+            for i in range(0, len(page), fetch_batch_size):
+                yield page[i:i + fetch_batch_size]
+
+    start = time.perf_counter()
+    exported = 0
+    since_commit = 0
+    in_flight = deque()
+    batches = id_batches()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            exhausted = False
+            while in_flight or not exhausted:
+                # Keep the fetch pipeline full without letting it grow unbounded
+                while not exhausted and len(in_flight) < 2 * max_workers:
+                    batch = next(batches, None)
+                    if batch is None:
+                        exhausted = True
+                    else:
+                        in_flight.append(executor.submit(fetch, batch))
+                if not in_flight:
+                    break
+
+                records = in_flight.popleft().result()
+                exported += _insert_records(cursor, records)
+                since_commit += len(records)
+
+                if since_commit >= commit_every:
+                    cursor.execute('COMMIT')
+                    cursor.execute('BEGIN')
+                    since_commit = 0
+                    elapsed = time.perf_counter() - start
+                    print(f"Exported {exported}/{total} records ({exported / elapsed:.0f} records/s)")
+
+        _create_indexes(cursor)
+        _build_facets(cursor)
+        cursor.execute('COMMIT')
+    except Exception as e:
+        print(f"Error exporting from Pinecone: {e}")
+        cursor.execute('ROLLBACK')
         conn.close()
+        raise
+
+    _finish_bulk_load(conn)
+    os.replace(tmp_path, db_path)
+
+    elapsed = time.perf_counter() - start
+    print(f"Exported {exported} records from Pinecone to {db_path} in {elapsed:.1f}s "
+          f"({exported / max(elapsed, 1e-9):.0f} records/s)")
+    return exported
 
 if __name__ == "__main__":
-    create_cheese_database()
+    parser = argparse.ArgumentParser(description="Build the SQLite cheese database")
+    parser.add_argument("--source", default=CATALOG_PATH,
+                        help="catalog JSON or JSONL journal of processed records")
+    parser.add_argument("--from-pinecone", action="store_true",
+                        help="export every vector's metadata from the Pinecone index instead")
+    args = parser.parse_args()
+
+    if args.from_pinecone:
+        export_from_pinecone()
+    else:
+        create_cheese_database(source=args.source)
@@ -0,0 +1,116 @@
+import os
+import queue
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+
+class SQLitePool:
+    """Fixed pool of read-only SQLite connections checked out per query.
+
+    Connections are opened up front with mode=ro&immutable=1 and query_only, so any
+    thread can borrow one without connection setup on the hot path. With in_memory=True
+    the database file is copied once through the backup API into a shared-cache
+    in-memory replica that every pooled connection reads from.
+
+    Immutable connections never notice changes to the file, so the database must be
+    replaced rather than modified in place (create_db builds into a temporary file);
+    reopen_if_changed() then swaps in connections to the new file.
+    """
+    def __init__(self, db_path, pool_size=8, cached_statements=256, in_memory=False, timeout=30):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.cached_statements = cached_statements
+        self.in_memory = in_memory
+        self.timeout = timeout
+        # Incremented every time the pool is reopened on a new database file
+        self.generation = 0
+        self._keeper = None
+        self._lock = threading.Lock()
+        self._open()
+
+    def _file_version(self):
+        try:
+            stat = os.stat(self.db_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _open(self):
+        """Open a full set of connections to the current database file"""
+        self.file_version = self._file_version()
+        if self.in_memory:
+            self.uri = f"file:cheese_replica_{uuid.uuid4().hex}?mode=memory&cache=shared"
+            # The keeper connection owns the replica; it lives as long as the pool
+            self._keeper = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+            source = sqlite3.connect(f"file:{os.path.abspath(self.db_path)}?mode=ro", uri=True)
+            try:
+                source.backup(self._keeper)
+            finally:
+                source.close()
+        else:
+            self.uri = f"file:{os.path.abspath(self.db_path)}?mode=ro&immutable=1"
+
+        pool = queue.LifoQueue(maxsize=self.pool_size)
+        for _ in range(self.pool_size):
+            pool.put(self._connect())
+        self._pool = pool
+
+    def reopen_if_changed(self):
+        """Reopen the pool if the database file was replaced; returns True when it was.
+
+        Connections borrowed from the old pool finish their query on the old file and
+        are closed when they are returned.
+        """
+        if self._file_version() == self.file_version:
+            return False
+
+        with self._lock:
+            if self._file_version() == self.file_version:
+                return False
+            old_pool, old_keeper = self._pool, self._keeper
+            self._open()
+            self.generation += 1
+            while not old_pool.empty():
+                old_pool.get_nowait().close()
+            if old_keeper is not None:
+                old_keeper.close()
+        print(f"Reopened SQLite pool on {self.db_path}")
+        return True
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        pool = self._pool
+        conn = pool.get(timeout=self.timeout)
+        try:
+            yield conn
+        finally:
+            if pool is self._pool:
+                pool.put(conn)
+            else:
+                conn.close()
+
+    def execute(self, query, params=()):
+        """Run a read query on a pooled connection and return all rows"""
+        with self.connection() as conn:
+            return conn.execute(query, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            while not self._pool.empty():
+                self._pool.get_nowait().close()
+            if self._keeper is not None:
+                self._keeper.close()
+                self._keeper = None
@@ -0,0 +1,148 @@
+import re
+import sqlite3
+import difflib
+
+# Comparisons against string literals, e.g. origin = 'Italy' or cheese.texture IN ('soft', 'firm')
+_EQUALS_PATTERN = re.compile(r"(?:\b\w+\.)?\b(\w+)\s*==?\s*'((?:[^']|'')*)'", re.IGNORECASE)
+_IN_PATTERN = re.compile(r"(?:\b\w+\.)?\b(\w+)\s+IN\s*\(([^()]*)\)", re.IGNORECASE)
+_LITERAL_PATTERN = re.compile(r"'((?:[^']|'')*)'")
+_RANGE_PATTERN = re.compile(r"(?:\b\w+\.)?\b(\w+)\s*(>=|<=|>|<)\s*(-?\d+(?:\.\d+)?)")
+
+_RANGE_OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def inline_params(sql, params):
+    """SQL with each ? placeholder (outside string literals) replaced by its parameter as a literal"""
+    params = iter(params)
+    parts, quoted = [], False
+    for char in sql:
+        if char == "'":
+            quoted = not quoted
+        if char == "?" and not quoted:
+            value = next(params, None)
+            if isinstance(value, str):
+                char = "'" + value.replace("'", "''") + "'"
+            elif value is not None:
+                char = repr(value)
+        parts.append(char)
+    return "".join(parts)
+
+
+class FacetCatalog:
+    """In-memory copy of the cheese_facet and cheese_histogram tables built by create_db"""
+    def __init__(self, db):
+        self.facets = {}
+        self.histograms = {}
+        self._lookup = {}
+        try:
+            for field, value, count in db.execute(
+                'SELECT field, value, count FROM cheese_facet ORDER BY field, count DESC, value'
+            ):
+                self.facets.setdefault(field, []).append((value, count))
+            for field, bucket, lower, upper, count in db.execute(
+                'SELECT field, bucket, lower, upper, count FROM cheese_histogram ORDER BY field, bucket'
+            ):
+                self.histograms.setdefault(field, []).append((lower, upper, count))
+        except sqlite3.OperationalError as e:
+            # Databases built before facets existed simply skip validation
+            print(f"Facet tables not available: {e}")
+
+        # Case-folded value -> canonical value, matching the NOCASE columns
+        self._lookup = {
+            field: {value.casefold(): value for value, _ in values}
+            for field, values in self.facets.items()
+        }
+
+    def fields(self):
+        return list(self.facets)
+
+    def values(self, field):
+        """(value, count) pairs for a categorical field, most common first"""
+        return self.facets.get(field, [])
+
+    def histogram(self, field):
+        """(lower, upper, count) buckets for a numeric field"""
+        return self.histograms.get(field, [])
+
+    def value_range(self, field):
+        buckets = self.histograms.get(field)
+        if not buckets:
+            return None
+        return buckets[0][0], buckets[-1][1]
+
+    def is_valid(self, field, value):
+        """True if value occurs for field (fields without facets are not checked)"""
+        lookup = self._lookup.get(field)
+        if lookup is None:
+            return True
+        return str(value).casefold() in lookup
+
+    def suggest(self, field, value, n=3):
+        """Closest known values for a misspelled or unknown value"""
+        lookup = self._lookup.get(field, {})
+        matches = difflib.get_close_matches(str(value).casefold(), list(lookup), n=n, cutoff=0.6)
+        return [lookup[match] for match in matches]
+
+    def _value_problem(self, field, value):
+        if self.is_valid(field, value):
+            return None
+        suggestions = self.suggest(field, value)
+        hint = f" (did you mean {', '.join(suggestions)}?)" if suggestions else ""
+        return f"{field} has no value '{value}'{hint}"
+
+    def _range_problem(self, field, operator, number):
+        bounds = self.value_range(field)
+        if bounds is None:
+            return None
+        low, high = bounds
+        if (operator == '>' and number >= high) or (operator == '>=' and number > high) \
+                or (operator == '<' and number <= low) or (operator == '<=' and number < low):
+            return f"{field} {operator} {number} is outside the catalog range {low:g} to {high:g}"
+        return None
+
+    def validate_sql(self, sql, params=()):
+        """Problems with literal or parameter values in generated SQL that would make it match nothing"""
+        if params:
+            sql = inline_params(sql, params)
+        problems = []
+        for field, value in _EQUALS_PATTERN.findall(sql):
+            problems.append(self._value_problem(field.lower(), value.replace("''", "'")))
+        for field, items in _IN_PATTERN.findall(sql):
+            for value in _LITERAL_PATTERN.findall(items):
+                problems.append(self._value_problem(field.lower(), value.replace("''", "'")))
+        for field, operator, number in _RANGE_PATTERN.findall(sql):
+            problems.append(self._range_problem(field.lower(), operator, float(number)))
+        return [problem for problem in problems if problem]
+
+    def validate_filter(self, filter):
+        """Problems with values in a Pinecone-style metadata filter"""
+        problems = []
+        if not isinstance(filter, dict):
+            return problems
+
+        for key, condition in filter.items():
+            if key in ("$and", "$or"):
+                for item in condition:
+                    problems.extend(self.validate_filter(item))
+                continue
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, operand in condition.items():
+                if operator in ("$eq", "$in") and isinstance(operand, (str, list)):
+                    for value in (operand if isinstance(operand, list) else [operand]):
+                        problems.append(self._value_problem(key, value))
+                elif operator in _RANGE_OPERATORS and isinstance(operand, (int, float)):
+                    problems.append(self._range_problem(key, _RANGE_OPERATORS[operator], operand))
+        return [problem for problem in problems if problem]
+
+    def prompt_summary(self, max_values=25):
+        """Compact listing of real catalog values to ground the LLM prompts"""
+        lines = []
+        for field, values in self.facets.items():
+            shown = ", ".join(value for value, _ in values[:max_values])
+            more = f" (+{len(values) - max_values} more)" if len(values) > max_values else ""
+            lines.append(f"        - {field}: {shown}{more}")
+        for field in self.histograms:
+            low, high = self.value_range(field)
+            lines.append(f"        - {field}: {low:g} to {high:g}")
+        return "\n".join(lines)
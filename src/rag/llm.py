@@ -1,24 +1,64 @@
-import json
-import yaml
-import os
-from openai import OpenAI
-from datetime import datetime
+import asyncio
 import json
 import os
+import time
 from datetime import datetime
+from ..knowledge_base.registry import get_async_openai_client, get_config, iterate_sync, run_sync
+from ..knowledge_base.tracing import get_tracer, usage_attrs
+from .context import select_context
+from .models import stage_model
 from .retriever import CheeseRetriever
 
+NO_INFO_PROMPT = """
+        You are a helpful, creative, and knowledgeable Cheese Expert assistant. You can answer questions on a wide range of topics
+        beyond cheese. Provide accurate, informative, and thoughtful responses to the user's questions. Exactly you have detailed information about 98 cheese products.
+        Politely decline to answer the question, explaining that you are specialized in cheese information only.
+        
+        - Be firm but friendly in your refusal
+        - Do NOT provide any information on the non-cheese topic
+        - Suggest they ask you about cheese instead
+        - Provide a brief example of what types of cheese questions you can answer
+        - Keep your response concise and clear
+        
+        Example refusal: "I'm sorry, but I'm a specialized cheese expert and can't answer questions about [topic].
+        """
+
+
+def context_prompt(context):
+    """System prompt for answering from the selected product context"""
+    return f"""
+            You are an expert cheese sommelier and product specialist. Answer the user's question using the provided cheese information in comprehensive detail.
+            
+            CHEESE INFORMATION:
+            {context}
+            
+            IMPORTANT INSTRUCTIONS:
+            1. Always include ALL cheese products in your response that are relevant
+            2. Create a separate section for EACH product with its own details
+            3. For each product, include a complete product overview
+            4. Format your response in a clean, organized way with clear sections
+            
+            Include:
+            - Product details (name, brand, price, etc.)
+            - Flavor profiles and characteristics
+            - Usage recommendations
+            - Images and shopping links when available
+            """
+
+
 class LLM:
     def __init__(self, config_path='config/config.yaml'):
-        # Load configuration
-        with open(config_path, 'r') as file:
-            self.config = yaml.safe_load(file)
+        # Load configuration (parsed once per process)
+        self.config = get_config(config_path)
         
         # Initialize retriever
         self.retriever = CheeseRetriever(config_path)
         
-        # Initialize OpenAI client
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Per-stage latency spans (a no-op unless tracing is enabled)
+        self.tracer = get_tracer(config_path)
+        
+        # Shared async OpenAI client; answers are generated on the process-wide event loop
+        self.async_client = get_async_openai_client(config_path)
         
         # Initialize chat history
         self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -26,19 +66,28 @@ class LLM:
     
     def answer_question(self, user_question):
         """Generate an answer to a user's question about cheese using RAG."""
+        return run_sync(self.answer_question_async(user_question))
+    
+    async def answer_question_async(self, user_question):
+        """Async answer_question; many conversations can be in flight on one event loop."""
+        with self.tracer.span("answer_question", question_chars=len(user_question)) as span:
+            answer = await self._answer_question_async(user_question)
+            span.set(answer_chars=len(answer or ""))
+            return answer
+    
+    async def _answer_question_async(self, user_question):
         # Add user message to history
         self.history.append({"role": "user", "content": user_question, "timestamp": datetime.now().isoformat()})
         
         # Retrieve relevant documents
-        documents = self.retriever.retrieve(user_question, top_k=5)
+        documents = await self.retriever.retrieve_async(user_question, top_k=self.config['rag'].get('top_k', 5))
         
         # Check if any documents were retrieved
         if not documents:
-            answer = self._generate_no_info_response(user_question)
+            answer = await self._generate_no_info_response_async(user_question)
         else:
-            # Format retrieved documents as context
-            print(documents)
-            context = json.dumps(documents)
+            # Keep only relevant, distinct products that fit the context budget
+            documents, context = self._select_context(documents)
             
             # Create prompt with context
             system_prompt = f"""
@@ -50,7 +99,7 @@ class LLM:
             In your response, include:
             First Show all the products in the context
             IMPORTANT INSTRUCTIONS:
-            1. As default, include ALL 5 cheese products in your response but under the user's requirement, you can include more than 5 products.
+            1. As default, include ALL the cheese products in the context in your response.
             2. PRODUCT INFORMATION:
                - Product name and brand
                - URL where the product can be purchased (format as clickable link)
@@ -87,52 +136,54 @@ class LLM:
             """
             
             # Generate response
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_question}
-                ],
-                temperature=0.7
-            )
-            
-            answer = response.choices[0].message.content
+            answer = await self._complete_async("completion", stage_model(self.config, 'answer'), system_prompt, user_question)
         
         # Add assistant response to history
         self.history.append({"role": "assistant", "content": answer, "timestamp": datetime.now().isoformat()})
         
         # Save history
-        self._save_history()
+        await asyncio.to_thread(self._save_history)
         
         return answer
     
 
+    def _select_context(self, documents):
+        """Prune retrieved documents by score, duplicates and token budget and format them as context"""
+        rag_config = self.config['rag']
+        with self.tracer.span("select_context", documents=len(documents)) as span:
+            selected, context, tokens = select_context(
+                documents,
+                similarity_threshold=rag_config.get('similarity_threshold', 0.3),
+                max_tokens=rag_config.get('context_max_tokens', 6000),
+                model=stage_model(self.config, 'answer')
+            )
+            span.set(selected=len(selected), context_tokens=tokens, context_bytes=len(context.encode()))
+        print(f"Context: {len(selected)} of {len(documents)} documents, {tokens} tokens")
+        return selected, context
+
     def _generate_no_info_response(self, user_question):
         """Generate a detailed response when no specific information is available."""
-        system_prompt = """
-        You are a helpful, creative, and knowledgeable Cheese Expert assistant. You can answer questions on a wide range of topics
-        beyond cheese. Provide accurate, informative, and thoughtful responses to the user's questions. Exactly you have detailed information about 98 cheese products.
-        Politely decline to answer the question, explaining that you are specialized in cheese information only.
-        
-        - Be firm but friendly in your refusal
-        - Do NOT provide any information on the non-cheese topic
-        - Suggest they ask you about cheese instead
-        - Provide a brief example of what types of cheese questions you can answer
-        - Keep your response concise and clear
-        
-        Example refusal: "I'm sorry, but I'm a specialized cheese expert and can't answer questions about [topic].
-        """
-        
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_question}
-            ],
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content
+        return run_sync(self._generate_no_info_response_async(user_question))
+    
+    async def _generate_no_info_response_async(self, user_question):
+        return await self._complete_async("no_info_completion", stage_model(self.config, 'refusal'), NO_INFO_PROMPT, user_question)
+    
+    async def _complete_async(self, stage, model, system_prompt, user_question):
+        """One chat completion, traced with its model, prompt size and token usage"""
+        print(f"{stage} model: {model}")
+        with self.tracer.span(stage, model=model, prompt_chars=len(system_prompt)) as span:
+            response = await self.async_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_question}
+                ],
+                temperature=self.config['rag'].get('temperature', 0.2),
+                max_tokens=self.config['rag'].get('max_tokens', 1000)
+            )
+            answer = response.choices[0].message.content
+            span.set(answer_chars=len(answer or ""), **usage_attrs(response))
+        return answer
 
     def get_history(self):
         """Get the current chat history."""
@@ -149,59 +200,110 @@ class LLM:
 
     def answer_question_with_context(self, user_question):
         """Generate an answer to a user's question and return both the answer and context."""
+        return run_sync(self.answer_question_with_context_async(user_question))
+    
+    async def answer_question_with_context_async(self, user_question):
+        with self.tracer.span("answer_question", question_chars=len(user_question)) as span:
+            answer, documents = await self._answer_question_with_context_async(user_question)
+            span.set(answer_chars=len(answer or ""), documents=len(documents))
+            return answer, documents
+    
+    async def _answer_question_with_context_async(self, user_question):
         # Add user message to history
         self.history.append({"role": "user", "content": user_question, "timestamp": datetime.now().isoformat()})
         
         # Retrieve relevant documents
-        documents = self.retriever.retrieve(user_question, top_k=5)
+        documents = await self.retriever.retrieve_async(user_question, top_k=self.config['rag'].get('top_k', 5))
         
         # Check if any documents were retrieved
         if not documents:
-            answer = self._generate_no_info_response(user_question)
+            answer = await self._generate_no_info_response_async(user_question)
             return answer, []
         else:
-            # Format retrieved documents as context
-            context = json.dumps(documents)
+            # Keep only relevant, distinct products that fit the context budget
+            documents, context = self._select_context(documents)
             
-            # Create prompt with context (your existing code)
-            system_prompt = f"""
-            You are an expert cheese sommelier and product specialist. Answer the user's question using the provided cheese information in comprehensive detail.
-            
-            CHEESE INFORMATION:
-            {context}
-            
-            IMPORTANT INSTRUCTIONS:
-            1. Always include ALL cheese products in your response that are relevant
-            2. Create a separate section for EACH product with its own details
-            3. For each product, include a complete product overview
-            4. Format your response in a clean, organized way with clear sections
-            
-            Include:
-            - Product details (name, brand, price, etc.)
-            - Flavor profiles and characteristics
-            - Usage recommendations
-            - Images and shopping links when available
-            """
+            # Create prompt with context
+            system_prompt = context_prompt(context)
             
             # Generate response
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_question}
-                ],
-                temperature=0.7
-            )
-            
-            answer = response.choices[0].message.content
+            answer = await self._complete_async("completion", stage_model(self.config, 'answer'), system_prompt, user_question)
         
         # Add assistant response to history
         self.history.append({"role": "assistant", "content": answer, "timestamp": datetime.now().isoformat()})
         
         # Save history
-        self._save_history()
+        await asyncio.to_thread(self._save_history)
         
         return answer, documents
+    
+    def stream_answer_with_context(self, user_question):
+        """Stream an answer: returns the context documents and a generator of answer text chunks.
+        
+        Retrieval finishes before this returns; the chunks arrive as the model produces them
+        and the history is saved once the generator is exhausted.
+        """
+        stream = iterate_sync(self._answer_stream_async(user_question))
+        return next(stream), stream
+    
+    async def stream_answer_with_context_async(self, user_question):
+        """Async stream_answer_with_context; iterate the chunks in the task that called it."""
+        stream = self._answer_stream_async(user_question)
+        return await stream.__anext__(), stream
+    
+    async def _answer_stream_async(self, user_question):
+        # Yields the selected documents first, then the answer text
+        with self.tracer.span("answer_question", question_chars=len(user_question), stream=True) as span:
+            self.history.append({"role": "user", "content": user_question, "timestamp": datetime.now().isoformat()})
+            
+            documents = await self.retriever.retrieve_async(user_question, top_k=self.config['rag'].get('top_k', 5))
+            if not documents:
+                stage, model, system_prompt = "no_info_completion", stage_model(self.config, 'refusal'), NO_INFO_PROMPT
+            else:
+                documents, context = self._select_context(documents)
+                stage, model, system_prompt = "completion", stage_model(self.config, 'answer'), context_prompt(context)
+            yield documents
+            
+            parts = []
+            async for chunk in self._stream_completion_async(stage, model, system_prompt, user_question):
+                parts.append(chunk)
+                yield chunk
+            answer = "".join(parts)
+            span.set(answer_chars=len(answer), documents=len(documents))
+        
+        self.history.append({"role": "assistant", "content": answer, "timestamp": datetime.now().isoformat()})
+        await asyncio.to_thread(self._save_history)
+    
+    async def _stream_completion_async(self, stage, model, system_prompt, user_question):
+        """Chat completion streamed as text deltas, traced with time to first token and usage"""
+        print(f"{stage} model: {model}")
+        with self.tracer.span(stage, model=model, prompt_chars=len(system_prompt), stream=True) as span:
+            start = time.perf_counter()
+            stream = await self.async_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_question}
+                ],
+                temperature=self.config['rag'].get('temperature', 0.2),
+                max_tokens=self.config['rag'].get('max_tokens', 1000),
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            
+            answer_chars = 0
+            async for chunk in stream:
+                # The final chunk carries the token usage and no choices
+                if getattr(chunk, "usage", None):
+                    span.set(**usage_attrs(chunk))
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if not answer_chars:
+                    self.tracer.observe("time_to_first_token", (time.perf_counter() - start) * 1000, model=model)
+                answer_chars += len(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+            span.set(answer_chars=answer_chars)
+
 # Example usage
 if __name__ == "__main__":
     llm = LLM()
@@ -0,0 +1,6 @@
+# Per-stage model routing; stages not listed under rag.models use rag.model
+
+def stage_model(config, stage):
+    """Model configured for a pipeline stage (planning, refusal, answer or fallback)"""
+    rag_config = config['rag']
+    return rag_config.get('models', {}).get(stage) or rag_config.get('model', 'gpt-4o')
@@ -1,77 +1,376 @@
+import asyncio
 import json
-import os
 import re
-import yaml
-from openai import OpenAI
-from pinecone import Pinecone
-from dotenv import load_dotenv
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, ValidationError, field_validator
+from typing import Optional, List, Union
 import sqlite3
+import httpx
+import numpy as np
+from ..knowledge_base.filters import FilterError, compile_filter
+from ..knowledge_base.lexical_index import BM25Index, fuse_rankings
+from ..knowledge_base.registry import (
+    get_async_openai_client,
+    get_config,
+    get_openai_client,
+    get_retrieval_cache,
+    get_shared_vector_store,
+    get_sqlite_pool,
+    get_vector_snapshot,
+    run_sync
+)
+from ..knowledge_base.tracing import get_tracer, usage_attrs
+from ..knowledge_base.vector_store import LocalVectorStore, Match
+from .cache import catalog_version
+from .facets import FacetCatalog
+from .models import stage_model
+from .router import QueryRouter
+from .schema import SCHEMA_DESCRIPTION
+from .sql_guard import SQLGuard, SQLGuardError
 
-class QueryResponse(BaseModel):
-    need_retrieve: bool
-    need_filtering_expression: bool
-    filtering_expression: Optional[str] = None
-    vector_search_criteria: str
+# Metadata fields the planner may filter on; anything else is rejected before reaching the store
+FILTER_FIELDS = ("brand", "origin", "color", "texture", "milk_type", "each_price", "price_per_unit", "each_weight")
+
+class QueryPlan(BaseModel):
+    """Everything retrieval needs from the LLM, produced by a single planning call"""
+    is_cheese_question: bool
+    sql_query: str = ""
+    sql_params: List[Union[str, int, float]] = []
+    metadata_filter: Optional[str] = None
+    search_query: str = ""
+    confidence: float = 1.0
+
+    @field_validator("metadata_filter", mode="before")
+    @classmethod
+    def _filter_as_json(cls, value):
+        # JSON mode often returns the filter as an object instead of a string
+        if isinstance(value, dict):
+            return json.dumps(value)
+        return value or None
+
+    def filter(self):
+        """metadata_filter parsed into a dict, or None when absent or malformed"""
+        if not self.metadata_filter:
+            return None
+        try:
+            parsed = json.loads(self.metadata_filter)
+        except json.JSONDecodeError:
+            return None
+        return parsed if isinstance(parsed, dict) and parsed else None
+
+
+# Static planning instructions; the catalog values are appended once so every request
+# shares the same prompt prefix
+PLAN_PROMPT = """Plan a product search for a cheese shop assistant. Reply with one JSON object:
+{"is_cheese_question": bool, "sql_query": str, "sql_params": [str or number], "metadata_filter": object or null, "search_query": str, "confidence": number}
+
+- is_cheese_question: false unless the question is about cheese products (types, brands, prices, origin, uses, pairings). If false, leave the other fields empty.
+- sql_query: "SELECT upc FROM cheese WHERE ..." with a ? placeholder for every value, or "" when the question has no filterable criteria. sql_params holds the values in order.
+- metadata_filter: the same criteria as a Pinecone filter over """ + ", ".join(FILTER_FIELDS) + """ ($eq $ne $in $nin $gt $gte $lt $lte $and $or), or null.
+- search_query: the question rewritten as a short product description for semantic search.
+- confidence: 0 to 1, how sure you are that the plan captures the question.
+
+Rules: prices use each_price unless the question says per lb or per unit (price_per_unit); weights use each_weight. Use = or IN on indexed columns, id IN (SELECT cheese_id FROM <child table> WHERE ...) for use cases, keywords and categories, and cheese_fts MATCH for other words. Never use LIKE '%...' or json_extract.
+
+Schema:""" + SCHEMA_DESCRIPTION + """
+Catalog values (filter only on these, numeric fields show their range):
+{facets}
+
+Example: "Italian cheeses under $20 for pizza" ->
+{"is_cheese_question": true, "sql_query": "SELECT upc FROM cheese WHERE origin = ? AND each_price < ? AND id IN (SELECT cheese_id FROM cheese_use_case WHERE use_case = ?)", "sql_params": ["Italy", 20, "pizza"], "metadata_filter": {"$and": [{"origin": "Italy"}, {"each_price": {"$lt": 20}}]}, "search_query": "Italian cheese for pizza", "confidence": 0.9}
+"""
 
 
 class CheeseRetriever:
     def __init__(self, config_path='config/config.yaml', db_path='data/cheese.db'):
-        # Load configuration
-        with open(config_path, 'r') as file:
-            self.config = yaml.safe_load(file)
+        # Load configuration (parsed once per process)
+        self.config_path = config_path
+        self.config = get_config(config_path)
         
-        # Load environment variables
-        load_dotenv()
+        # Per-stage latency spans (a no-op unless tracing is enabled)
+        self.tracer = get_tracer(config_path)
         
-        # Initialize OpenAI client
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Shared OpenAI clients with pooled connections (async one for the retrieval chain)
+        self.client = get_openai_client(config_path)
+        self.async_client = get_async_openai_client(config_path)
         
-        # Initialize Pinecone for vector search only
-        self.pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-        self.index = self.pc.Index(self.config['vector_db']['pinecone']['index_name'])
-        
-        # Initialize SQLite connection
+        # Pool of read-only SQLite connections, one per database file, shared by all sessions/threads
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
+        sqlite_config = self.config.get('sqlite', {})
+        self.db = get_sqlite_pool(db_path, config_path)
+        
+        # Generated SQL runs through a guard that bounds its plan, runtime and result size
+        self.sql_guard = SQLGuard(
+            self.db,
+            max_rows=sqlite_config.get('max_rows', 500),
+            timeout_ms=sqlite_config.get('timeout_ms', 250),
+            max_scan_rows=sqlite_config.get('max_scan_rows', 50000)
+        )
+        
+        # One planning call per question; its prompt is built once so the prefix stays identical
+        planner_config = self.config['rag'].get('planner', {})
+        self.reembed_search_query = planner_config.get('reembed_search_query', False)
+        
+        # Planning runs on a cheap model and is redone on the fallback model when its plan is unusable
+        cascade_config = self.config['rag'].get('cascade', {})
+        self.cascade = cascade_config.get('enabled', True)
+        self.min_confidence = cascade_config.get('min_confidence', 0.6)
+        
+        # Facet values built at ingestion ground the planning prompt, validate filters locally
+        # and drive the rule-based router that answers common questions without the LLM
+        self._load_facets()
+        
+        # Retrieval mode: "vector" (SQL filter + vector search) or "hybrid" (adds BM25 with RRF)
+        self.retrieval_mode = self.config['rag'].get('retrieval_mode', 'vector')
+        self.lexical_index = None
+        if self.retrieval_mode == 'hybrid':
+            self.lexical_index = BM25Index.load(self.config['lexical_index']['path'])
+        
+        # Candidate sets up to this size are re-scored locally instead of sent as an $in filter,
+        # using the local snapshot written next to the Pinecone index when it exists
+        self.rescore_max_candidates = self.config['rag'].get('rescore_max_candidates', 1000)
+        # The candidate query is capped here rather than at sqlite.max_rows; a larger match
+        # set is searched through the plan's metadata filter instead of an arbitrary subset
+        self.max_candidates = max(self.config['rag'].get('max_candidates', 10000), self.rescore_max_candidates)
+        self._load_stores()
+        self._upc_map = {}
+        self._upc_map_version = None
+        
+        # Retrieval results cache (exact and near-duplicate questions), shared by all sessions
+        self.cache = None
+        if self.config['rag'].get('cache', {}).get('enabled', True):
+            self.cache = get_retrieval_cache(db_path, config_path)
+        
+        # A rebuilt cheese.db is picked up when this fingerprint changes
+        self._catalog_version = self.catalog_version()
+    
+    def _load_stores(self):
+        """Vector store and candidate snapshot, shared by every retriever through the registry"""
+        self.index = get_shared_vector_store(self.config_path)
+        self.candidate_store = None
+        if self.config['vector_db'].get('backend') == 'pinecone':
+            self.candidate_store = get_vector_snapshot(self.config_path)
+    
+    def _load_facets(self):
+        """(Re)build everything derived from the facet tables of the current database"""
+        self._facets_generation = self.db.generation
+        self.facets = FacetCatalog(self.db)
+        self.plan_prompt = PLAN_PROMPT.replace("{facets}", self.facets.prompt_summary())
+        
+        router_config = self.config['rag'].get('router', {})
+        self.router = None
+        if router_config.get('enabled', True):
+            self.router = QueryRouter(self.facets, max_unknown_tokens=router_config.get('max_unknown_tokens', 0))
+    
+    def _sync_catalog(self):
+        """Current catalog version; after a rebuild the stores, pool and facets are reloaded"""
+        version = self.catalog_version()
+        if version != self._catalog_version:
+            self._catalog_version = version
+            self._load_stores()
+            # The pool is shared, so another retriever may already have reopened it
+            self.db.reopen_if_changed()
+            if self.db.generation != self._facets_generation:
+                self._load_facets()
+        return version
     
     def retrieve(self, user_question, top_k=20):
         """Retrieve cheese information using vector search + SQLite filtering."""
-        # Generate embedding for semantic search
-        embedding = self.generate_embedding(user_question)
+        return run_sync(self.retrieve_async(user_question, top_k))
+    
+    async def retrieve_async(self, user_question, top_k=20):
+        """Async retrieval on the shared event loop; network calls never hold a thread."""
+        with self.tracer.span("retrieve", top_k=top_k, question_chars=len(user_question)) as span:
+            documents = await self._retrieve_async(user_question, top_k, span)
+            span.set(documents=len(documents))
+            return documents
+    
+    async def _retrieve_async(self, user_question, top_k, span):
+        # File stats (and a pool reopen after a rebuild) run on a worker thread, not the event loop
+        version = await asyncio.to_thread(self._sync_catalog)
         
-        # Generate SQL query from user question
-        sql_query, use_sql_filtering, is_cheese_question = self.generate_sql_query(user_question)
+        # Repeated questions are answered from the cache without any network calls
+        if self.cache:
+            cached = self.cache.get(user_question, top_k, version)
+            if cached is not None:
+                print("Retrieval cache hit (exact)")
+                span.set(cache="exact")
+                return cached
         
-        # If not a cheese question, return empty results
-        if not is_cheese_question:
-            return []
+        # Common questions are routed locally and skip the planning LLM call
+        routed = self.router.route(user_question) if self.router else None
+        span.set(routed=routed is not None)
+        plan = None
+        if routed is not None:
+            sql_query, sql_params, use_sql_filtering, is_cheese_question = routed
+            print(f"Routed locally (hit rate {self.router.stats()['hit_rate']:.0%})")
+            if not is_cheese_question:
+                return []
         
-        if use_sql_filtering:
-            # Approach 1: SQL first, then vector search on filtered IDs
-            cheese_upc = self.execute_sql_query(sql_query)
-            print(cheese_upc)
-            # If no results from SQL, fall back to vector-only search
-            if not cheese_upc:
-                return self.vector_only_search(embedding, top_k)
+        # Embedding and planning are independent network calls, so run them at the same time
+        embedding_task = asyncio.create_task(self.generate_embedding_async(user_question))
+        plan_task = search_task = None
+        if routed is None:
+            plan_task = asyncio.create_task(self.generate_query_plan_async(user_question))
+        
+        try:
+            # Near-duplicate questions reuse cached results once the embedding is in
+            if self.cache:
+                embedding = await embedding_task
+                cached = self.cache.get_similar(user_question, embedding, top_k, version)
+                if cached is not None:
+                    print("Retrieval cache hit (semantic)")
+                    span.set(cache="semantic")
+                    return cached
+            
+            search_task = embedding_task
+            if plan_task:
+                plan = await plan_task
+                sql_query, sql_params = plan.sql_query, tuple(plan.sql_params)
+                use_sql_filtering, is_cheese_question = bool(sql_query), plan.is_cheese_question
+                
+                # Optionally search with the rewritten query (costs a second, sequential embedding)
+                if self.reembed_search_query and is_cheese_question and plan.search_query \
+                        and plan.search_query.strip().lower() != user_question.strip().lower():
+                    search_task = asyncio.create_task(self.generate_embedding_async(plan.search_query))
+            
+            # If not a cheese question, the embedding is cancelled in the finally block
+            if not is_cheese_question:
+                if self.cache:
+                    self.cache.put(user_question, None, [], top_k, version)
+                return []
             
-            # Do vector search with ID filter
-            results = self.index.query(
-                vector=embedding,
-                top_k=top_k,
-                include_metadata=True,
-                filter={"upc": {"$in": cheese_upc}}
+            documents = await self._search_async(
+                user_question, search_task, sql_query, sql_params, use_sql_filtering, top_k,
+                metadata_filter=plan.filter() if plan else None
             )
-            # print(len(results.matches))
-        else:
-            # No filtering needed, do vector-only search
-            return self.vector_only_search(embedding, top_k)
+            if self.cache:
+                self.cache.put(user_question, embedding_task.result(), documents, top_k, version)
+            return documents
+        finally:
+            # Drop whichever call is still in flight (non-cheese question, cache hit or error)
+            for task in (embedding_task, plan_task, search_task):
+                if task is not None and not task.done():
+                    task.cancel()
+    
+    def catalog_version(self):
+        """Fingerprint of the SQLite, vector and lexical files; changes invalidate the cache"""
+        # The local path holds the local store, or the candidate snapshot on Pinecone
+        paths = [self.db_path, self.config['vector_db'].get('local', {}).get('path')]
+        if self.lexical_index is not None:
+            paths.append(self.config['lexical_index']['path'])
+        return catalog_version(*paths)
+    
+    async def _search_async(self, user_question, embedding_task, sql_query, sql_params, use_sql_filtering, top_k,
+                            metadata_filter=None):
+        # Filters on values that don't exist would only return nothing, so drop them up front
+        if use_sql_filtering:
+            problems = self.facets.validate_sql(sql_query, sql_params)
+            if problems:
+                print(f"Skipping SQL filter: {'; '.join(problems)}")
+                use_sql_filtering = False
         
-        # Process and return the results
+        # The plan's metadata filter stands in when its SQL can't be used
+        if metadata_filter is not None and self.filter_problems(metadata_filter):
+            metadata_filter = None
+        
+        cheese_upc = []
+        if use_sql_filtering:
+            # Approach 1: SQL first, then vector search on filtered IDs (SQLite reads run on a worker thread)
+            with self.tracer.span("sql_execute", sql_chars=len(sql_query)) as span:
+                cheese_upc, truncated = await asyncio.to_thread(self.execute_sql_query, sql_query, sql_params)
+                span.set(rows=len(cheese_upc), truncated=truncated)
+            if truncated:
+                print(f"SQL matched more than {self.max_candidates} products, searching with the metadata filter")
+                cheese_upc = []
+            else:
+                metadata_filter = None
+            print(cheese_upc)
+        
+        embedding = await embedding_task
+        
+        if self.retrieval_mode == 'hybrid':
+            return await self.hybrid_search_async(user_question, embedding, top_k, cheese_upc)
+        
+        # If no filtering is needed or SQL returned nothing, this is a vector-only search
+        with self.tracer.span("vector_search", candidates=len(cheese_upc), top_k=top_k) as span:
+            if metadata_filter is not None:
+                matches = await self._filtered_search_async(embedding, top_k, metadata_filter)
+            else:
+                matches = await self._vector_search_async(embedding, top_k, cheese_upc)
+            span.set(matches=len(matches))
+        return self._to_documents(matches)
+    
+    async def _vector_search_async(self, embedding, top_k, cheese_upc=None):
+        """Vector matches, restricted to the SQL candidates when there are any"""
+        if not cheese_upc:
+            return (await self.index.query_async(embedding, top_k, include_metadata=True)).matches
+        
+        # Small candidate sets are scored locally; only large ones become an $in filter
+        if len(cheese_upc) <= self.rescore_max_candidates:
+            matches = await self.rescore_candidates_async(embedding, cheese_upc, top_k)
+            if matches is not None:
+                return matches
+        
+        result = await self.index.query_async(
+            embedding,
+            top_k,
+            filter={"upc": {"$in": cheese_upc}},
+            include_metadata=True
+        )
+        return result.matches
+    
+    async def _filtered_search_async(self, embedding, top_k, metadata_filter):
+        """Vector search restricted by a metadata filter, unfiltered if the store rejects it"""
+        try:
+            return (await self.index.query_async(embedding, top_k, filter=metadata_filter, include_metadata=True)).matches
+        except (FilterError, httpx.HTTPStatusError) as e:
+            print(f"Dropping metadata filter: {e}")
+            return (await self.index.query_async(embedding, top_k, include_metadata=True)).matches
+    
+    def _vector_ids(self, cheese_upc):
+        """Vector ids of the given UPCs, from a UPC map reloaded when the catalog changes"""
+        version = self.catalog_version()
+        if self._upc_map_version != version:
+            upc_map = {}
+            for upc, vector_id in self.db.execute('SELECT upc, vector_id FROM cheese'):
+                upc_map.setdefault(upc, []).append(vector_id)
+            self._upc_map, self._upc_map_version = upc_map, version
+        return [vector_id for upc in dict.fromkeys(cheese_upc) for vector_id in self._upc_map.get(upc, ())]
+    
+    def rescore_candidates(self, embedding, cheese_upc, top_k):
+        return run_sync(self.rescore_candidates_async(embedding, cheese_upc, top_k))
+    
+    async def rescore_candidates_async(self, embedding, cheese_upc, top_k):
+        """Score the candidates' stored embeddings against the query with one dot product.
+        
+        Embeddings come from the local snapshot when there is one and from a batched fetch
+        otherwise. Returns None when the store can't fetch vectors.
+        """
+        # The UPC map query and the snapshot lookup run on a worker thread
+        ids = await asyncio.to_thread(self._vector_ids, cheese_upc)
+        try:
+            found = await self.candidate_store.fetch_async(ids) if self.candidate_store is not None else {}
+            missing = [vector_id for vector_id in ids if vector_id not in found]
+            if missing:
+                found.update(await self.index.fetch_async(missing))
+        except NotImplementedError:
+            return None
+        
+        if not found:
+            return []
+        
+        candidates = list(found.values())
+        matrix = LocalVectorStore._normalize([match.values for match in candidates])
+        scores = matrix @ LocalVectorStore._normalize(embedding)
+        top = np.argsort(-scores)[:top_k]
+        return [
+            Match(candidates[i].id, float(scores[i]), metadata=candidates[i].metadata)
+            for i in top
+        ]
+    
+    def _to_documents(self, matches):
         documents = []
-        for match in results.matches:
+        for match in matches:
             documents.append({
                 "text": match.metadata.get("text", ""),
                 "metadata": match.metadata,
@@ -80,278 +379,137 @@ class CheeseRetriever:
         
         return documents
     
-    def vector_only_search(self, embedding, top_k):
-        """Perform vector search without filtering"""
-        results = self.index.query(
-            vector=embedding,
-            top_k=top_k,
-            include_metadata=True
-        )
+    def hybrid_search(self, user_question, embedding, top_k, cheese_upc=None):
+        return run_sync(self.hybrid_search_async(user_question, embedding, top_k, cheese_upc))
+    
+    async def hybrid_search_async(self, user_question, embedding, top_k, cheese_upc=None):
+        """Run BM25 and vector search concurrently and fuse them with reciprocal rank fusion"""
+        with self.tracer.span("hybrid_search", candidates=len(cheese_upc or ()), top_k=top_k) as span:
+            vector_matches, lexical_matches = await asyncio.gather(
+                self._vector_search_async(embedding, top_k, cheese_upc),
+                asyncio.to_thread(self.lexical_index.search, user_question, top_k, cheese_upc or None)
+            )
+            span.set(vector_matches=len(vector_matches), lexical_matches=len(lexical_matches))
         
-        documents = []
-        for match in results.matches:
-            documents.append({
+        # Collect every candidate once, keeping the cosine score where the vector leg found it
+        documents = {}
+        for match in vector_matches:
+            documents[match.id] = {
                 "text": match.metadata.get("text", ""),
                 "metadata": match.metadata,
-                "score": match.score
+                "score": match.score,
+                "lexical_score": None
+            }
+        for doc_id, lexical_score, metadata in lexical_matches:
+            document = documents.setdefault(doc_id, {
+                "text": metadata.get("text", ""),
+                "metadata": metadata,
+                "score": None
             })
+            document["lexical_score"] = lexical_score
         
-        return documents
+        fused = fuse_rankings(
+            [[match.id for match in vector_matches], [doc_id for doc_id, _, _ in lexical_matches]],
+            k=self.config['rag'].get('rrf_k', 60)
+        )
+        
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        results = []
+        for doc_id, rrf_score in ranked:
+            document = documents[doc_id]
+            document["rrf_score"] = rrf_score
+            results.append(document)
+        
+        return results
+    
+    def vector_only_search(self, embedding, top_k):
+        """Perform vector search without filtering"""
+        return self._to_documents(run_sync(self._vector_search_async(embedding, top_k)))
     
     def generate_embedding(self, text):
         """Generate embedding for vector search"""
-        response = self.client.embeddings.create(
-            model=self.config['vector_db']['embeddings']['model'],
-            input=text
-        )
+        return run_sync(self.generate_embedding_async(text))
+    
+    async def generate_embedding_async(self, text):
+        with self.tracer.span("embedding", input_chars=len(text)) as span:
+            response = await self.async_client.embeddings.create(
+                model=self.config['vector_db']['embeddings']['model'],
+                input=text
+            )
+            span.set(**usage_attrs(response))
         return response.data[0].embedding
     
-    def generate_sql_query(self, user_question):
-        """Generate SQL query from user question using GPT or identify non-cheese questions."""
-        system_prompt = """
-        You are an AI that converts natural language questions about cheese into SQL queries.
-        
-        IMPORTANT: First determine if the question is actually about cheese. Questions about cheese include:
-        - Inquiries about specific cheese types, brands, flavors, or properties
-        - Questions about cheese pricing, origin, texture, color, etc.
-        - Requests for cheese recommendations, pairings, or culinary uses
-        
-        If the question is NOT about cheese (like technology, politics, general knowledge, other foods, etc.),
-        you MUST set "use_sql_filtering" to false and "sql_query" to empty string.
-        If the price in the question is in the normal form, just use the each_price.
-        If the price in the question is in the unit form, just use the price_per_unit.
-        If the weight in the question is in the normal form, just use the each_weight.
-        The database has a table called 'cheese' with these columns:
-        - id: unique identifier
-        - title: cheese name
-        - description: detailed cheese description
-        - brand: manufacturer
-        - origin: country of origin
-        - color: cheese color
-        - texture: texture description
-        - price_per_unit: price in dollars
-        - case_price: price for a case
-        - each_price: price for each
-        - each_weight: weight of each
-        - case_weight: weight of case
-        - milk_type: type of milk used (cow, goat, sheep, etc.)
-        - flavor_profile: taste characteristics
-        - sku: stock keeping unit
-        - upc: universal product code
-        - image_urls: URLs to product images (stored as JSON string)
-        - url: product webpage URL
-        - related_items: similar products (stored as JSON string)
-        - use_cases: recommended applications (stored as JSON string)
-        - vector_id: ID for vector search
-        - keywords: relevant keywords (stored as JSON string)
-        
-        Rules:
-        1. Generate a SQL query based on the user's question filtering criteria ONLY if cheese-related
-        2. Return both the SQL query and a boolean indicating if filtering should be used
-        3. Use LIKE with % wildcards for string searches (e.g., '%Italy%')
-        4. Use appropriate numeric comparisons for prices and weights
-        5. For JSON fields, use json_extract or string matching
-        6. If the question is not about cheese at all, return empty query and false
-        
-        Output format:
-        {
-            "sql_query": "SELECT upc FROM cheese WHERE...",
-            "use_sql_filtering": true/false,
-            "is_cheese_question": true/false
-        }
-        
-        Examples:
-        Q: "Show me Italian cheeses"
-        A: {
-            "sql_query": "SELECT upc FROM cheese WHERE origin LIKE '%Italy%'", 
-            "use_sql_filtering": true,
-            "is_cheese_question": true
-        }
-        
-        Q: "What is Python programming?"
-        A: {
-            "sql_query": "",
-            "use_sql_filtering": false,
-            "is_cheese_question": false
-        }
-        
-        Q: "What are some cheeses good for pizza?"
-        A: {
-            "sql_query": "SELECT upc FROM cheese WHERE use_cases LIKE '%pizza%' OR keywords LIKE '%pizza%'",
-            "use_sql_filtering": true,
-            "is_cheese_question": true
-        }
-        """
+    def generate_query_plan(self, user_question):
+        """Decide whether the question is about cheese and plan its SQL filter, metadata filter and search text."""
+        return run_sync(self.generate_query_plan_async(user_question))
+    
+    async def generate_query_plan_async(self, user_question):
+        model = stage_model(self.config, 'planning')
+        plan, problem = await self._request_plan_async(user_question, model)
         
-        response = self.client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_question}
-            ],
-            response_format={"type": "json_object"}
-        )
+        # Escalate to the stronger model when the cheap one's plan fails validation or is unsure
+        fallback = stage_model(self.config, 'fallback')
+        if problem and self.cascade and fallback != model:
+            print(f"Planning escalated from {model} to {fallback}: {problem}")
+            model = fallback
+            plan, problem = await self._request_plan_async(user_question, model)
         
-        result = json.loads(response.choices[0].message.content)
-        is_cheese_question = result.get("is_cheese_question", False)
+        print(f"Planning model: {model}")
+        if plan is None:
+            # An unusable plan falls back to an unfiltered search on the question itself
+            print(f"Invalid query plan: {problem}")
+            return QueryPlan(is_cheese_question=True, search_query=user_question)
+        return plan
+    
+    async def _request_plan_async(self, user_question, model):
+        """One planning call; returns (plan or None, problem or None)"""
+        with self.tracer.span("query_planning", model=model, prompt_chars=len(self.plan_prompt)) as span:
+            response = await self.async_client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": self.plan_prompt},
+                    {"role": "user", "content": user_question}
+                ],
+                response_format={"type": "json_object"}
+            )
+            span.set(**usage_attrs(response))
         
-        # Return the SQL query and whether to use it, plus whether it's a cheese question
-        return result["sql_query"], result["use_sql_filtering"], is_cheese_question
+        try:
+            plan = QueryPlan.model_validate_json(response.choices[0].message.content)
+        except ValidationError as e:
+            return None, f"{e.error_count()} validation errors"
+        
+        problems = []
+        if plan.confidence < self.min_confidence:
+            problems.append(f"confidence {plan.confidence:g}")
+        if plan.is_cheese_question and plan.sql_query:
+            problems.extend(self.facets.validate_sql(plan.sql_query, plan.sql_params))
+        if plan.is_cheese_question and plan.filter():
+            problems.extend(self.filter_problems(plan.filter()))
+        return plan, "; ".join(problems) or None
+    
+    def filter_problems(self, metadata_filter):
+        """Unknown fields or operators in a metadata filter, else values missing from the catalog"""
+        try:
+            compile_filter(metadata_filter, FILTER_FIELDS)
+        except FilterError as e:
+            return [str(e)]
+        return self.facets.validate_filter(metadata_filter)
     
-    def execute_sql_query(self, query):
-        """Execute SQL query and return cheese IDs"""
+    def execute_sql_query(self, query, params=()):
+        """Execute a guarded SQL query and return (cheese IDs, whether more than max_candidates matched)"""
         try:
-            self.cursor.execute(query)
-            results = self.cursor.fetchall()
-            return [row[0] for row in results]  # Assuming first column is ID
+            results, stats = self.sql_guard.run(query, params, max_rows=self.max_candidates)
+            return [row[0] for row in results], stats["truncated"]  # Assuming first column is ID
+        except SQLGuardError as e:
+            print(f"SQL rejected: {e}")
+            return [], False
         except sqlite3.Error as e:
             print(f"SQLite error: {e}")
-            return []
-
-    def generate_query_response(self, user_question):
-        system_prompt = """
-        You are an AI assistant that analyzes user questions to determine:
-        1. If the question is related to cheese products
-        2. If metadata filtering is needed and what filter to apply
-        3. What vector search criteria will yield the best results
-
-        Output object with the following structure:
-        {
-            "need_retrieve": true/false,   # Set true if query is about cheese, false otherwise
-            "need_filtering_expression": true/false,   # Set true if metadata filtering is possible
-            "filtering_expression": "filtering_expression_string_or_null",   # Valid Pinecone filter or null
-            "vector_search_criteria": "optimized_search_query"   # Enhanced search query
-        }
-
-        RULES FOR DETERMINING need_retrieve:
-        - Set TRUE if the query is asking about cheese products, brands, types, uses, etc.
-        - Set FALSE if the query is a general question, unrelated to cheese, or a greeting
-
-        RULES FOR DETERMINING need_filtering_expression:
-        - Set TRUE if the query contains specific criteria that can be filtered using metadata only about the price and color,origin,sku,texture,brand
-        - Set FALSE if the query is general, vague, or can't be filtered with available metadata fields
-
-        VALID PINECONE FILTER OPERATORS:
-        - Exact match: {"field": "value"}
-        - Comparison (numeric): {"field": {"$gt": number}}, {"field": {"$gte": number}}, {"field": {"$lt": number}}, {"field": {"$lte": number}}
-        - Not equal: {"field": {"$ne": "value"}}
-        - In list: {"field": {"$in": ["value1", "value2"]}}
-        - Not in list: {"field": {"$nin": ["value1", "value2"]}}
-        - Logical AND: {"$and": [filter1, filter2, ...]}
-        - Logical OR: {"$or": [filter1, filter2, ...]}
-
-        The complete metadata schema includes:
-        - all_categories, category, subcategory: Cheese categories and classifications
-        - brand: Manufacturer or producer brand name
-        - case_dimensions, each_dimensions: Physical dimensions information
-        - case_pack_size, each_pack_size: Packaging quantity information
-        - case_price, each_price, price_per_unit: Price information at different levels
-        - case_weight, each_weight: Weight information at different levels
-        - color: Visual color of the cheese
-        - flavor_profile: Taste characteristics and flavor notes
-        - image_description: Detailed description of the product
-        - image_urls: URLs to product images
-        - keywords: Key terms associated with the product
-        - milk_type: Type of milk used (cow, goat, sheep, etc.)
-        - origin: Country or region of origin
-        - others_you_may_like_urls: URLs to similar products
-        - related_items: Associated products (stored as a string representation of a list)
-        - sku, upc: Product identification codes
-        - texture: Physical texture of the cheese
-        - title: Product title/name
-        - url: Product URL
-        - use_cases: Recommended applications and uses for the cheese
-        The fields that are available in the metadata:
-        - price_per_unit
-        - case_price
-        - each_price
-        - case_weight
-        - each_weight
-        - color
-        - origin
-        - texture
-        - brand
-        So many filters can decrease the performance of the retrieval, so only use the fields that are available in the metadata and if you can't find the fields that are available in the metadata and so certain criteria,  then don't use any filters
-        And about the price, if the word "case" or "each" or "unit" or "lb" don't appear, just use the price_per_unit.
-        RULES FOR CONSTRUCTING filtering_expression:
-        1. For partial text matching, Pinecone does not support substring matching
-        2. For negating an exact match, use: {"field": {"$ne": "value"}}
-        3. For negating multiple values, use: {"field": {"$nin": ["value1", "value2"]}}
-        4. For complex conditions, use AND/OR operators: {"$and": [{"field1": "value"}, {"$or": [{...}, {...}]}]}
-        5. Always use double quotes for keys and string values in the JSON
-
-
-        EXAMPLES OF filtering_expression:
-        - Find exact product: {"sku": "103601"}
-        - Price range: {"$and": [{"price_per_unit": {"$gte": 5}}, {"price_per_unit": {"$lte": 10}}]}
-        - Multiple conditions: {"$and": [{"brand": "Galbani"}, {"subcategory": "Specialty Cheese"}]}
-        - Exclude American cheese: {"title": {"$ne": "American"}}
-        - Find certain textures: {"texture": {"$in": ["firm", "hard"]}}
-        - Exclude certain origins: {"origin": {"$nin": ["France", "Italy"]}}
-
-        RULES FOR VECTOR SEARCH CRITERIA:
-        - Rephrase vague queries to be more specific
-        - Include important cheese characteristics and terms
-        - For queries needing substring matching (which Pinecone can't filter), optimize vector search terms
-        - Keep relevant context but make it concise and focused
-
-        EXAMPLES:
-        
-        EXAMPLE 1:
-        User query: "What cheeses are made in Italy?"
-        Response:
-        {
-            "need_retrieve": true,
-            "need_filtering_expression": true,
-            "filtering_expression": {"origin": "Italy"},
-            "vector_search_criteria": "Italian cheese varieties origin Italy"
-        }
-        
-        EXAMPLE 2:
-        User query: "What's the weather like today?"
-        Response:
-        {
-            "need_retrieve": false,
-            "need_filtering_expression": false,
-            "filtering_expression": null,
-            "vector_search_criteria": ""
-        }
-        
-        EXAMPLE 3:
-        User query: "I want soft creamy cheeses that work well on crackers"
-        Response:
-        {
-            "need_retrieve": true,
-            "need_filtering_expression": true,
-            "filtering_expression": {"texture": "soft"},
-            "vector_search_criteria": "soft creamy cheese crackers appetizer spread"
-        }
-        
-        EXAMPLE 4:
-        User query: "Do you have any cheeses with herbs?"
-        Response:
-        {
-            "need_retrieve": true,
-            "need_filtering_expression": false,
-            "filtering_expression": null,
-            "vector_search_criteria": "cheese with herbs flavored herbed specialty cheese"
-        }
-        """
-        
-        # Send the request to GPT
-        response = self.client.beta.chat.completions.parse(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_question}
-            ],
-            response_format=QueryResponse,
-        )
-        query_response = response.choices[0].message.parsed
-        return query_response
+            return [], False
 
 # cheese_retriever = CheeseRetriever()
-# print(cheese_retriever.generate_query_response("I want to buy a cheese that related to the brand 'Galbani'"))
+# print(cheese_retriever.generate_query_plan("I want to buy a cheese that related to the brand 'Galbani'"))
 
 # Example usage
 # retriever = CheeseRetriever()
@@ -0,0 +1,185 @@
+import re
+import threading
+
+# Greetings and small talk answered without retrieval
+_SMALL_TALK = {
+    "hi", "hello", "hey", "thanks", "thank", "you", "bye", "goodbye", "ok", "okay",
+    "good", "morning", "afternoon", "evening", "how", "are", "yo", "cheers"
+}
+
+# Words that make a question clearly about cheese even without a catalog value
+_CHEESE_TERMS = {
+    "cheese", "cheeses", "cheesy", "mozzarella", "cheddar", "parmesan", "parmigiano", "romano",
+    "pecorino", "provolone", "ricotta", "feta", "brie", "camembert", "gouda", "edam", "swiss",
+    "gruyere", "emmental", "havarti", "muenster", "colby", "jack", "pepper", "asiago", "fontina",
+    "mascarpone", "burrata", "halloumi", "manchego", "gorgonzola", "blue", "bleu", "stilton",
+    "queso", "cotija", "paneer", "kasseri", "american", "string", "curds", "curd", "cheesecake"
+}
+
+# Cheese words that name a product rather than cheese in general
+_PRODUCT_TERMS = _CHEESE_TERMS - {"cheese", "cheeses", "cheesy"}
+
+# Shopping verbs that make a question about the catalog even without a cheese word
+_SHOPPING_VERBS = {"sell", "sells", "carry", "carries", "have", "has", "show"}
+
+# Filler words that carry no filtering intent
+_FILLER = {
+    "s", "a", "an", "the", "i", "me", "my", "we", "you", "your", "do", "does", "have", "has", "any",
+    "some", "show", "find", "list", "give", "get", "want", "need", "looking", "look", "for",
+    "what", "which", "who", "where", "is", "are", "there", "of", "from", "made", "in", "with",
+    "and", "or", "to", "that", "this", "these", "those", "all", "can", "could", "would", "please",
+    "recommend", "suggest", "good", "best", "great", "nice", "options", "option", "products",
+    "product", "items", "item", "kind", "kinds", "type", "types", "brand", "brands", "by",
+    "sell", "carry", "buy", "available", "price", "priced", "cost", "costs", "costing", "cheap",
+    "per", "lb", "lbs", "pound", "pounds", "unit", "each", "dollars", "dollar", "usd", "on",
+    "about", "tell", "like", "it", "them", "one", "ones", "use", "used", "using", "texture",
+    "color", "colored", "milk", "origin", "country", "style", "m", "re", "ve", "ll", "d",
+    # Product forms left to the vector search rather than filtered on
+    "smoked", "sliced", "slices", "shredded", "grated", "grating", "crumbles", "crumbled",
+    "fresh", "aged", "block", "blocks", "wheel", "snack", "snacks"
+}
+
+# Negations and comparisons between products need the LLM
+_AMBIGUOUS = {"not", "no", "without", "except", "excluding", "exclude", "but", "compare", "versus", "vs", "difference"}
+
+# Adjectives that name an origin value
+_DEMONYMS = {
+    "italian": "Italy", "french": "France", "greek": "Greece",
+    "english": "England", "british": "England", "mexican": "Mexico",
+    "spanish": "Spain", "dutch": "Netherlands", "german": "Germany"
+}
+
+# Facet fields the router can filter on and the SQL that tests one of them
+_FIELD_SQL = {
+    "brand": "brand IN ({})",
+    "origin": "origin IN ({})",
+    "texture": "texture IN ({})",
+    "color": "color IN ({})",
+    "milk_type": "milk_type IN ({})",
+    "use_case": "id IN (SELECT cheese_id FROM cheese_use_case WHERE use_case IN ({}))",
+    "category": "id IN (SELECT cheese_id FROM cheese_category WHERE category IN ({}))",
+}
+
+# Category values too generic to filter on
+_GENERIC_VALUES = {"cheese", "unknown"}
+
+_NUMBER = r"\$?\s*(\d+(?:\.\d+)?)"
+_BETWEEN_PATTERN = re.compile(r"\bbetween\s+" + _NUMBER + r"\s*(?:and|-|to)\s*" + _NUMBER)
+_MAX_PATTERN = re.compile(r"\b(?:under|below|less than|cheaper than|at most|up to|no more than|max(?:imum)?)\s+" + _NUMBER)
+_MIN_PATTERN = re.compile(r"\b(?:over|above|more than|at least|min(?:imum)?)\s+" + _NUMBER)
+_UNIT_PRICE_PATTERN = re.compile(r"\bper\s+(?:lb|pound|unit|oz)\b|/\s*lb\b|\ba\s+pound\b")
+_WORD_PATTERN = re.compile(r"[a-z]+|\d+(?:\.\d+)?")
+
+
+class QueryRouter:
+    """Rule-based router that answers common questions without the SQL-generation LLM call.
+
+    route() returns (sql_query, params, use_sql_filtering, is_cheese_question) when it is
+    confident, or None when the question should go to the LLM. A question is routed as a
+    cheese question only when it has cheese vocabulary or a shopping verb; a facet value
+    alone ("the capital of France", "pizza dough") is not enough. When a product or brand
+    is named, a use case is left to the vector search instead of filtered on, so "gruyere
+    for fondue" still finds a Gruyère whose listing doesn't mention fondue.
+    """
+    def __init__(self, facets, max_unknown_tokens=0):
+        self.max_unknown_tokens = max_unknown_tokens
+        self.routed = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+        # Longest phrases first so "cream cheese" wins over the color "cream"
+        phrases = []
+        for field in _FIELD_SQL:
+            for value, _ in facets.values(field):
+                if value.casefold() not in _GENERIC_VALUES:
+                    phrases.append((value.casefold(), field, value))
+        for demonym, origin in _DEMONYMS.items():
+            if facets.is_valid("origin", origin) and facets.values("origin"):
+                phrases.append((demonym, "origin", origin))
+        phrases.sort(key=lambda item: len(item[0]), reverse=True)
+        self._phrases = [
+            (re.compile(r"\b" + re.escape(phrase) + r"(?:s|es)?\b"), field, value)
+            for phrase, field, value in phrases
+        ]
+
+        # "cow" also selects "likely cow" and similar hedged milk types
+        self._milk_types = [value for value, _ in facets.values("milk_type")]
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.routed += 1
+            else:
+                self.fallbacks += 1
+
+    def stats(self):
+        """Routed/fallback counts and the share of questions that skipped the LLM"""
+        with self._lock:
+            total = self.routed + self.fallbacks
+            return {
+                "routed": self.routed,
+                "fallbacks": self.fallbacks,
+                "hit_rate": self.routed / total if total else 0.0
+            }
+
+    def _price_conditions(self, text):
+        """Price comparisons found in the question, and the text with them removed"""
+        column = "price_per_unit" if _UNIT_PRICE_PATTERN.search(text) else "each_price"
+        conditions, params = [], []
+        for pattern, template in ((_BETWEEN_PATTERN, "{} BETWEEN ? AND ?"),
+                                  (_MAX_PATTERN, "{} <= ?"), (_MIN_PATTERN, "{} >= ?")):
+            for match in pattern.finditer(text):
+                conditions.append(template.format(column))
+                params.extend(float(number) for number in match.groups())
+            text = pattern.sub(" ", text)
+        return conditions, params, text
+
+    def route(self, question):
+        text = question.lower()
+        words = _WORD_PATTERN.findall(text)
+
+        if not words or _AMBIGUOUS & set(words):
+            self._record(False)
+            return None
+
+        if set(words) <= _SMALL_TALK:
+            self._record(True)
+            return "", (), False, False
+
+        conditions, params, text = self._price_conditions(text)
+
+        matched = {}
+        for pattern, field, value in self._phrases:
+            if pattern.search(text):
+                matched.setdefault(field, []).append(value)
+                text = pattern.sub(" ", text)
+        if "milk_type" in matched:
+            words_matched = {word for value in matched["milk_type"] for word in value.casefold().split()}
+            matched["milk_type"] = [
+                value for value in self._milk_types
+                if words_matched & set(value.casefold().split())
+            ]
+
+        remaining = _WORD_PATTERN.findall(text)
+        is_cheese = bool((_CHEESE_TERMS | _SHOPPING_VERBS) & set(words))
+        unknown = [word for word in remaining if word not in _FILLER and word not in _CHEESE_TERMS
+                   and word not in _SHOPPING_VERBS]
+
+        # Unparsed numbers or unexplained words ("sky", "history") mean the LLM should decide
+        if not is_cheese or any(word[0].isdigit() for word in unknown) \
+                or len(unknown) > self.max_unknown_tokens:
+            self._record(False)
+            return None
+
+        if "use_case" in matched and ("brand" in matched or _PRODUCT_TERMS & set(words)):
+            del matched["use_case"]
+
+        for field, values in matched.items():
+            values = list(dict.fromkeys(values))
+            conditions.append(_FIELD_SQL[field].format(", ".join("?" * len(values))))
+            params.extend(values)
+
+        self._record(True)
+        if not conditions:
+            return "", (), False, True
+        return f"SELECT upc FROM cheese WHERE {' AND '.join(conditions)}", tuple(params), True, True
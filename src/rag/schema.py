@@ -0,0 +1,11 @@
+# Description of the cheese.db schema built by create_db.py, shared with the SQL generator
+
+SCHEMA_DESCRIPTION = """
+- cheese(id, upc, title, description, brand, origin, color, texture, milk_type, flavor_profile,
+  each_price, case_price, price_per_unit, each_weight, case_weight, sku, url)
+  brand, origin, color, texture and milk_type are indexed and compare case-insensitively
+- cheese_use_case(cheese_id, use_case), cheese_keyword(cheese_id, keyword),
+  cheese_category(cheese_id, category): lowercase values, cheese_id references cheese.id
+- cheese_fts(upc, title, description, keywords, use_cases, categories): FTS5 over product text,
+  e.g. upc IN (SELECT upc FROM cheese_fts WHERE cheese_fts MATCH 'title:smoked OR description:smoked')
+"""
@@ -0,0 +1,177 @@
+import re
+import time
+import sqlite3
+import threading
+from collections import deque
+
+# Literals and comments are blanked out before the statement is inspected
+_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_FORBIDDEN_PATTERN = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|ATTACH|DETACH|PRAGMA|VACUUM|REINDEX)\b",
+    re.IGNORECASE
+)
+_TABLE_ALIAS_PATTERN = re.compile(
+    r"(?:\bFROM|\bJOIN|,)\s*([A-Za-z_][A-Za-z0-9_]*)(?:\s+(?:AS\s+)?([A-Za-z_][A-Za-z0-9_]*))?",
+    re.IGNORECASE
+)
+_SQL_KEYWORDS = {"FROM", "SELECT", "WHERE", "JOIN", "ON", "LEFT", "INNER", "CROSS", "GROUP", "ORDER", "LIMIT", "USING", "NATURAL", "UNION"}
+
+
+class SQLGuardError(Exception):
+    """Raised when generated SQL is rejected or exceeds its budget"""
+
+
+def check_statement(sql):
+    """Return the statement without trailing semicolons if it is a single SELECT, else raise"""
+    statement = sql.strip().rstrip(';').strip()
+    stripped = _COMMENT_PATTERN.sub(' ', _LITERAL_PATTERN.sub("''", statement))
+
+    if not statement:
+        raise SQLGuardError("Empty query")
+    if ';' in stripped:
+        raise SQLGuardError("Only a single statement is allowed")
+    if not re.match(r"\s*(SELECT|WITH)\b", stripped, re.IGNORECASE):
+        raise SQLGuardError("Only SELECT queries are allowed")
+    forbidden = _FORBIDDEN_PATTERN.search(stripped)
+    if forbidden:
+        raise SQLGuardError(f"Keyword not allowed: {forbidden.group(1).upper()}")
+    return statement
+
+
+def table_aliases(sql):
+    """Map every table name and alias in FROM/JOIN/comma-join clauses to its table name"""
+    aliases = {}
+    for table, alias in _TABLE_ALIAS_PATTERN.findall(_LITERAL_PATTERN.sub("''", sql)):
+        aliases[table.lower()] = table.lower()
+        if alias and alias.upper() not in _SQL_KEYWORDS:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+
+class SQLGuard:
+    """Executes generated SQL with a plan check, a time budget and a row cap"""
+    def __init__(self, pool, max_rows=500, timeout_ms=250, max_scan_rows=50000,
+                 progress_steps=1000, history_size=1000):
+        self.pool = pool
+        self.max_rows = max_rows
+        self.timeout_ms = timeout_ms
+        self.max_scan_rows = max_scan_rows
+        self.progress_steps = progress_steps
+        self.history = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._table_rows = None
+        self._table_rows_generation = None
+
+    def table_rows(self, conn, generation=0):
+        """Row count of every table, read from sqlite_stat1 (falls back to COUNT(*)).
+
+        Counts are read on the connection the caller already holds, since checking out a
+        second one blocks when the pool is exhausted. They are cached per pool generation,
+        so they are read again once the pool is reopened on a rebuilt database.
+        """
+        if self._table_rows is None or self._table_rows_generation != generation:
+            counts = {}
+            try:
+                for table, _, stat in conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1"):
+                    rows = int(str(stat).split()[0])
+                    counts[table.lower()] = max(counts.get(table.lower(), 0), rows)
+            except sqlite3.OperationalError:
+                pass
+            tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+            for (table,) in tables:
+                if table.lower() not in counts and not table.startswith('sqlite_'):
+                    try:
+                        counts[table.lower()] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+                    except sqlite3.Error:
+                        continue
+            self._table_rows, self._table_rows_generation = counts, generation
+        return self._table_rows
+
+    def explain(self, conn, sql, params=()):
+        """EXPLAIN QUERY PLAN detail lines"""
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+    def scan_cost(self, conn, sql, plan, generation=0):
+        """Rows touched by full table scans, multiplied across nested scans (cross joins)"""
+        aliases = table_aliases(sql)
+        table_rows = self.table_rows(conn, generation)
+        cost = 1
+        scanned = False
+        for detail in plan:
+            if not detail.startswith('SCAN ') or 'VIRTUAL TABLE' in detail:
+                continue
+            name = detail.split()[1].lower()
+            table = aliases.get(name, name)
+            if table in table_rows:
+                cost *= max(table_rows[table], 1)
+                scanned = True
+        return cost if scanned else 0
+
+    def execute(self, sql, params=(), max_rows=None):
+        """Run one guarded SELECT and return at most max_rows rows"""
+        return self.run(sql, params, max_rows)[0]
+
+    def run(self, sql, params=(), max_rows=None):
+        """Run one guarded SELECT and return (rows, stats); max_rows overrides the guard's row cap
+        and stats["truncated"] tells whether more rows matched"""
+        max_rows = self.max_rows if max_rows is None else max_rows
+        stats = {"sql": sql, "plan": [], "rows": 0, "truncated": False, "status": "ok"}
+        start = time.perf_counter()
+        try:
+            statement = check_statement(sql)
+            # Read before checkout: a connection borrowed afterwards is never older than this
+            generation = getattr(self.pool, 'generation', 0)
+            with self.pool.connection() as conn:
+                stats["plan"] = self.explain(conn, statement, params)
+                cost = self.scan_cost(conn, statement, stats["plan"], generation)
+                stats["scan_rows"] = cost
+                if cost > self.max_scan_rows:
+                    raise SQLGuardError(f"Full scan over ~{cost} rows exceeds the limit of {self.max_scan_rows}")
+
+                deadline = time.perf_counter() + self.timeout_ms / 1000.0
+                conn.set_progress_handler(lambda: time.perf_counter() > deadline, self.progress_steps)
+                try:
+                    cursor = conn.execute(statement, params)
+                    rows = cursor.fetchmany(max_rows + 1)
+                    cursor.close()
+                except sqlite3.OperationalError as e:
+                    if 'interrupted' in str(e):
+                        raise SQLGuardError(f"Query exceeded {self.timeout_ms} ms")
+                    raise
+                finally:
+                    conn.set_progress_handler(None, 0)
+
+            if len(rows) > max_rows:
+                rows = rows[:max_rows]
+                stats["truncated"] = True
+            stats["rows"] = len(rows)
+            return rows, stats
+        except Exception as e:
+            stats["status"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            stats["latency_ms"] = (time.perf_counter() - start) * 1000
+            with self._lock:
+                self.history.append(stats)
+            print(f"SQL {stats['status']}: {stats['rows']} rows in {stats['latency_ms']:.1f} ms, plan: {stats['plan']}")
+
+    def summary(self):
+        """Latency percentiles and outcome counts over the recorded queries"""
+        with self._lock:
+            history = list(self.history)
+        if not history:
+            return {"queries": 0}
+
+        latencies = sorted(item["latency_ms"] for item in history)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+        return {
+            "queries": len(history),
+            "rejected": sum(1 for item in history if item["status"] != "ok"),
+            "truncated": sum(1 for item in history if item["truncated"]),
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "max_ms": latencies[-1]
+        }
@@ -1,28 +1,15 @@
 import json
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
-import httpx
 import urllib.parse
-import yaml
+from knowledge_base.registry import get_config, get_http_client, get_openai_client
 
 class ImageProcessor:
     def __init__(self, config_path='config/config.yaml'):
-        # Load configuration
-        with open(config_path, 'r') as file:
-            self.config = yaml.safe_load(file)
+        # Load configuration (parsed once per process)
+        self.config = get_config(config_path)
         
-        # Load environment variables
-        load_dotenv()
-        
-        # Initialize HTTP client
-        self.http_client = httpx.Client()
-        
-        # Initialize OpenAI client
-        self.client = OpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            http_client=self.http_client
-        )
+        # Shared pooled HTTP client and the OpenAI client built on it
+        self.http_client = get_http_client(config_path)
+        self.client = get_openai_client(config_path)
     
     def get_original_image_url(self, next_js_url):
         """Extract the original image URL from a Next.js image URL"""
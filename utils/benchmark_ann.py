@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+# Add src to the Python path
+sys.path.append(os.path.abspath('src'))
+
+from knowledge_base.ann_index import IVFPQIndex
+
+def make_dataset(n, dim, n_queries, seed=0):
+    """Clustered synthetic vectors plus perturbed copies used as queries"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(16, n // 1000), dim)).astype(np.float32)
+    data = centers[rng.integers(0, len(centers), size=n)]
+    data += 0.5 * rng.normal(size=data.shape).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+
+    queries = data[rng.choice(n, size=n_queries, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return data, queries
+
+def exact_search(data, queries, k, chunk_size=100000):
+    """Ground-truth top-k ids and the brute-force QPS"""
+    start = time.perf_counter()
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((len(queries), k), dtype=np.int64)
+    for offset in range(0, len(data), chunk_size):
+        scores = queries @ data[offset:offset + chunk_size].T
+        scores = np.concatenate([best_scores, scores], axis=1)
+        ids = np.concatenate([best_ids, np.arange(offset, offset + scores.shape[1] - k)[None, :].repeat(len(queries), 0)], axis=1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(ids, top, axis=1)
+    elapsed = time.perf_counter() - start
+    return best_ids, len(queries) / elapsed
+
+def run(n, dim, m, nlist, nprobes, k, n_queries, refine_factor):
+    print(f"\n=== {n:,} vectors, dim={dim} ===")
+    data, queries = make_dataset(n, dim, n_queries)
+
+    truth, exact_qps = exact_search(data, queries, k)
+    print(f"exact brute force: {exact_qps:,.1f} QPS")
+
+    with tempfile.TemporaryDirectory() as path:
+        # Build incrementally, as the ingestion sync would, then persist
+        index = IVFPQIndex(path, dimension=dim, nlist=nlist, m=m, refine_factor=refine_factor)
+        start = time.perf_counter()
+        batch = 100000
+        for offset in range(0, n, batch):
+            ids = [str(i) for i in range(offset, min(offset + batch, n))]
+            index.add(ids, data[offset:offset + batch])
+        index.flush()
+        print(f"build: {time.perf_counter() - start:.1f}s (nlist={index.nlist}, m={m})")
+
+        # Fresh instance loads lazily from disk on the first query
+        index = IVFPQIndex(path, dimension=dim, refine_factor=refine_factor)
+        start = time.perf_counter()
+        index.query(queries[0], k, include_metadata=False)
+        print(f"lazy load + first query: {(time.perf_counter() - start) * 1000:.1f} ms")
+        for nprobe in nprobes:
+            found = []
+            start = time.perf_counter()
+            for query in queries:
+                result = index.query(query, k, include_metadata=False, nprobe=nprobe)
+                found.append({int(match.id) for match in result.matches})
+            elapsed = time.perf_counter() - start
+
+            recall = np.mean([len(set(truth[i]) & found[i]) / k for i in range(len(queries))])
+            print(f"nprobe={nprobe:<4} recall@{k}={recall:.4f}  {len(queries) / elapsed:,.1f} QPS")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the IVF-PQ index against exact search")
+    parser.add_argument("--sizes", default="100000,1000000", help="comma separated dataset sizes")
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--m", type=int, default=32)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", default="1,4,8,16,32")
+    parser.add_argument("--refine-factor", type=int, default=10)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    nprobes = [int(value) for value in args.nprobe.split(",")]
+    for n in [int(value) for value in args.sizes.split(",")]:
+        run(n, args.dim, args.m, args.nlist, nprobes, args.k, args.queries, args.refine_factor)
+
+if __name__ == "__main__":
+    main()
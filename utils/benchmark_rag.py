@@ -0,0 +1,325 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import types
+import asyncio
+import hashlib
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+import numpy as np
+import yaml
+
+# Add the repository root to the Python path (src.rag uses package-relative imports)
+sys.path.append(os.path.abspath('.'))
+
+from src.knowledge_base.data_processor import process_cheese_data
+from src.knowledge_base.lexical_index import build_lexical_index
+from src.knowledge_base.vector_store import LocalVectorStore
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbedder:
+    """Deterministic local embeddings: signed feature hashing of words and word pairs with IDF weights"""
+    def __init__(self, dimension=1536):
+        self.dimension = dimension
+        self.idf = {}
+        self.default_idf = 1.0
+
+    @staticmethod
+    def features(text):
+        words = [word[:-1] if len(word) > 3 and word.endswith('s') else word
+                 for word in _TOKEN_PATTERN.findall(text.lower())]
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def fit(self, texts):
+        document_frequency = Counter()
+        for text in texts:
+            document_frequency.update(set(self.features(text)))
+        self.idf = {feature: math.log((1 + len(texts)) / (1 + count)) + 1 for feature, count in document_frequency.items()}
+        self.default_idf = math.log(1 + len(texts)) + 1
+        return self
+
+    def embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature, count in Counter(self.features(text)).items():
+            digest = hashlib.md5(feature.encode()).digest()
+            position = int.from_bytes(digest[:4], 'little') % self.dimension
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[position] += sign * (1 + math.log(count)) * self.idf.get(feature, self.default_idf)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+
+def _response(content, usage=None):
+    """Minimal object with the attributes the RAG code reads from a chat completion"""
+    usage = types.SimpleNamespace(**usage) if usage else None
+    message = types.SimpleNamespace(content=content)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+
+async def _stream_response(content, usage=None):
+    """Chunks shaped like a streamed chat completion, ending with a usage-only chunk"""
+    for piece in re.findall(r"\S+\s*|\s+", content):
+        delta = types.SimpleNamespace(content=piece)
+        yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)], usage=None)
+    yield types.SimpleNamespace(choices=[], usage=types.SimpleNamespace(**usage) if usage else None)
+
+
+def stub_completion(request):
+    """Deterministic answer used when a request has no recording.
+
+    A planning call is answered with an unfiltered plan that treats every question as
+    being about cheese, so questions it decides are left out of rejection_rate.
+    """
+    if request.get("response_format", {}).get("type") == "json_object":
+        question = request["messages"][-1]["content"]
+        return json.dumps({
+            "is_cheese_question": True,
+            "sql_query": "",
+            "sql_params": [],
+            "search_query": question
+        })
+    return "Stub answer (no recorded completion for this prompt)."
+
+
+class ReplayClient:
+    """Stand-in for AsyncOpenAI.
+
+    Chat completions are replayed from recordings keyed by a hash of the request; misses
+    are recorded from live_client when one is given and answered by stub_completion
+    otherwise. Embeddings always come from the local HashingEmbedder.
+    """
+    def __init__(self, embedder, recordings, live_client=None, replay_latency=False):
+        self.embedder = embedder
+        self.recordings = recordings
+        self.live_client = live_client
+        self.replay_latency = replay_latency
+        self.calls = Counter()
+        self.embeddings = types.SimpleNamespace(create=self._embed)
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._complete))
+
+    @staticmethod
+    def request_key(request):
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def _embed(self, model, input, **kwargs):
+        self.calls["embedding"] += 1
+        texts = input if isinstance(input, list) else [input]
+        data = [types.SimpleNamespace(embedding=self.embedder.embed(text), index=i) for i, text in enumerate(texts)]
+        return types.SimpleNamespace(data=data, usage=None)
+
+    async def _complete(self, **request):
+        self.calls["chat"] += 1
+        # Streamed and plain requests share recordings; streams are replayed in word-sized chunks
+        stream = request.pop("stream", False)
+        request.pop("stream_options", None)
+        key = self.request_key(request)
+        recording = self.recordings.get(key)
+
+        if recording is not None:
+            self.calls["chat_replayed"] += 1
+            if self.replay_latency:
+                await asyncio.sleep(recording["latency_ms"] / 1000)
+        elif self.live_client is not None:
+            self.calls["chat_recorded"] += 1
+            start = time.perf_counter()
+            response = await self.live_client.chat.completions.create(**request)
+            usage = response.usage.model_dump() if getattr(response, "usage", None) else None
+            recording = self.recordings[key] = {
+                "model": request.get("model"),
+                "content": response.choices[0].message.content,
+                "usage": {name: usage[name] for name in ("prompt_tokens", "completion_tokens", "total_tokens")} if usage else None,
+                "latency_ms": (time.perf_counter() - start) * 1000
+            }
+        else:
+            self.calls["chat_stubbed"] += 1
+            if request.get("response_format", {}).get("type") == "json_object":
+                self.calls["planning_stubbed"] += 1
+            recording = {"content": stub_completion(request)}
+
+        if stream:
+            return _stream_response(recording["content"], recording.get("usage"))
+        return _response(recording["content"], recording.get("usage"))
+
+
+def build_environment(workdir, args):
+    """Local vector store, BM25 index and a config pointing the RAG stack at them"""
+    with open('config/config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    dimension = config['vector_db']['pinecone']['dimension']
+
+    with open('data/image-processed/cheese_data_with_image_descriptions.json', 'r') as f:
+        processed_data = process_cheese_data(json.load(f))
+
+    embedder = HashingEmbedder(dimension).fit([item['text'] for item in processed_data])
+    store = LocalVectorStore(os.path.join(workdir, 'vectors'), dimension=dimension)
+    store.upsert([
+        {"id": f"cheese_{i}", "values": embedder.embed(item['text']), "metadata": item['metadata']}
+        for i, item in enumerate(processed_data)
+    ])
+    store.flush()
+    build_lexical_index(processed_data, os.path.join(workdir, 'bm25.json'))
+
+    config['vector_db']['backend'] = 'local'
+    config['vector_db']['local'].update({"path": store.path, "quantization": "none", "index": "flat"})
+    config['lexical_index']['path'] = os.path.join(workdir, 'bm25.json')
+    config['rag']['retrieval_mode'] = args.mode
+    config['rag'].setdefault('cache', {})['enabled'] = args.cache
+    config['tracing'] = {"enabled": True, "path": os.path.join(workdir, 'traces.jsonl')}
+    if not args.record:
+        # The OpenAI client is still constructed, but never called
+        config['api_keys']['openai_api_key'] = 'offline'
+
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as file:
+        yaml.safe_dump(config, file)
+    return config_path, embedder
+
+
+def score(retrieved, expected, k):
+    """recall@k and reciprocal rank of the first expected UPC"""
+    top = retrieved[:k]
+    recall = len(set(top) & set(expected)) / min(k, len(expected))
+    reciprocal_rank = next((1 / rank for rank, upc in enumerate(top, 1) if upc in expected), 0.0)
+    return recall, reciprocal_rank
+
+
+def stage_percentiles(trace_path):
+    """Exact p50/p95 per span name from the trace file"""
+    durations = defaultdict(list)
+    if os.path.exists(trace_path):
+        with open(trace_path, 'r') as f:
+            for line in f:
+                span = json.loads(line)
+                durations[span["name"]].append(span["duration_ms"])
+    return {
+        name: {"count": len(values), "p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95))}
+        for name, values in durations.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval and answer benchmark for the cheese RAG pipeline")
+    parser.add_argument("--questions", default="data/benchmark/questions.json")
+    parser.add_argument("--recordings", default="data/benchmark/recordings.json")
+    parser.add_argument("--record", action="store_true", help="call OpenAI for chat completions missing from the recordings and save them")
+    parser.add_argument("--replay-latency", action="store_true", help="sleep for the recorded latency of each replayed completion")
+    parser.add_argument("--mode", default="vector", choices=["vector", "hybrid"])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--answers", action="store_true", help="also run LLM.answer_question for every question")
+    parser.add_argument("--stream", action="store_true", help="answer through LLM.stream_answer_with_context (reports time to first token)")
+    parser.add_argument("--cache", action="store_true", help="keep the retrieval cache enabled")
+    parser.add_argument("--output", help="write the metrics as JSON to this path")
+    args = parser.parse_args()
+
+    with open(args.questions, 'r') as f:
+        questions = json.load(f)
+    recordings = {}
+    if os.path.exists(args.recordings):
+        with open(args.recordings, 'r') as f:
+            recordings = json.load(f)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        config_path, embedder = build_environment(workdir, args)
+
+        from src.knowledge_base.registry import get_async_openai_client
+        from src.rag.llm import LLM
+        llm = LLM(config_path)
+        client = ReplayClient(
+            embedder, recordings,
+            live_client=get_async_openai_client(config_path) if args.record else None,
+            replay_latency=args.replay_latency
+        )
+        llm.async_client = llm.retriever.async_client = client
+        # Benchmark runs don't write chat history files
+        llm._save_history = lambda: None
+
+        results = []
+        for item in questions:
+            question, expected = item["question"], item["expected_upcs"]
+            client.calls.clear()
+            documents = llm.retriever.retrieve(question, top_k=args.k)
+            retrieved = [document["metadata"].get("upc") for document in documents]
+            result = {"question": question, "retrieved": retrieved, "retrieve_calls": dict(client.calls)}
+            if expected:
+                result["recall"], result["reciprocal_rank"] = score(retrieved, expected, args.k)
+            else:
+                result["rejected"] = not documents
+
+            if args.answers:
+                client.calls.clear()
+                if args.stream:
+                    _, chunks = llm.stream_answer_with_context(question)
+                    "".join(chunks)
+                else:
+                    llm.answer_question(question)
+                result["answer_calls"] = dict(client.calls)
+            results.append(result)
+
+            quality = f"recall@{args.k}={result['recall']:.2f} rr={result['reciprocal_rank']:.2f}" if expected \
+                else f"rejected={result['rejected']}"
+            print(f"{question[:50]:<50} {quality:<28} chat calls={result['retrieve_calls'].get('chat', 0)}")
+
+        stages = stage_percentiles(os.path.join(workdir, 'traces.jsonl'))
+
+    answerable = [result for result in results if "recall" in result]
+    # Off-topic questions count towards rejection_rate only when the router or a recorded
+    # planning call decided them; the planning stub accepts everything
+    unanswerable = [result for result in results if "rejected" in result]
+    decided = [result for result in unanswerable if not result["retrieve_calls"].get("planning_stubbed")]
+    chat_calls = Counter()
+    for result in results:
+        chat_calls.update(result["retrieve_calls"])
+        chat_calls.update(result.get("answer_calls", {}))
+
+    summary = {
+        "mode": args.mode,
+        "k": args.k,
+        "questions": len(results),
+        f"recall@{args.k}": float(np.mean([result["recall"] for result in answerable])) if answerable else None,
+        "mrr": float(np.mean([result["reciprocal_rank"] for result in answerable])) if answerable else None,
+        "rejection_rate": float(np.mean([result["rejected"] for result in decided])) if decided else None,
+        "rejection_questions": len(decided),
+        "rejection_stubbed": len(unanswerable) - len(decided),
+        "llm_calls_per_question": chat_calls["chat"] / len(results) if results else 0.0,
+        "llm_calls": dict(chat_calls),
+        # "stubbed" when some planning calls had no recording
+        "planning": "stubbed" if chat_calls["planning_stubbed"] else "recorded",
+        "stages": stages
+    }
+
+    print(f"\n=== {len(results)} questions, mode={args.mode} ===")
+    for name in (f"recall@{args.k}", "mrr", "rejection_rate", "llm_calls_per_question"):
+        if summary[name] is not None:
+            print(f"{name:<24} {summary[name]:.3f}")
+        elif name == "rejection_rate" and unanswerable:
+            print(f"{name:<24} n/a (planner stubbed)")
+    if decided and summary["rejection_stubbed"]:
+        print(f"{'':<24} over {len(decided)} of {len(unanswerable)} off-topic questions, the rest hit the planning stub")
+    print(f"{'llm calls':<24} {dict(chat_calls)}")
+    if chat_calls["chat_stubbed"]:
+        print(f"warning: {chat_calls['chat_stubbed']} completions had no recording and were stubbed (run with --record)")
+    if chat_calls["planning_stubbed"]:
+        print(f"warning: {chat_calls['planning_stubbed']} planning calls were stubbed; questions they decided "
+              "are left out of rejection_rate")
+    print(f"\n{'stage':<20} {'count':>6} {'p50 ms':>10} {'p95 ms':>10}")
+    for name, stats in sorted(stages.items(), key=lambda item: -item[1]["p50_ms"]):
+        print(f"{name:<20} {stats['count']:>6} {stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f}")
+
+    if args.record:
+        os.makedirs(os.path.dirname(args.recordings) or ".", exist_ok=True)
+        with open(args.recordings, 'w') as f:
+            json.dump(recordings, f, indent=2)
+        print(f"Saved {len(recordings)} recorded completions to {args.recordings}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"summary": summary, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
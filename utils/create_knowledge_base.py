@@ -9,6 +9,7 @@ sys.path.append(os.path.abspath('src'))
 
 # Import knowledge base modules
 from knowledge_base import process_cheese_data, create_pinecone_index, upsert_to_pinecone
+from knowledge_base.lexical_index import build_lexical_index
 
 def main():
     # Ensure config directory exists
@@ -37,6 +38,15 @@ def main():
     print("Uploading vectors to Pinecone...")
     upsert_to_pinecone(processed_data, batch_size=config['vector_db']['embeddings']['batch_size'])
     
+    # Build the BM25 index used by hybrid retrieval
+    print("Building lexical index...")
+    build_lexical_index(
+        processed_data,
+        config['lexical_index']['path'],
+        k1=config['lexical_index']['k1'],
+        b=config['lexical_index']['b']
+    )
+    
     print("Knowledge base creation complete!")
 
 if __name__ == "__main__":